@@ -0,0 +1,484 @@
+# coding=utf-8
+"""
+Checks that DbusNmcli gives the same answers as the nmcli parsing. Starts a private dbus-daemon with a mock
+NetworkManager service on it, and answers the nmcli and dbus-send commands of Nmcli from the same model, in the
+form nmcli 0.9.10 prints them. Every read-only query is asked of both backends and the answers are compared
+as the JSON the plugin would send. Exits with 1 when they differ.
+
+The model covers what the backends map differently: the security strings of the access points, addresses
+that D-Bus sends as integers, the active IP of a connection, profile names that are not the SSID and values
+that nmcli has to escape. Needs dbus-python, a GLib main loop and dbus-daemon.
+
+    python benchmarks/dbus_equivalence.py
+"""
+from __future__ import print_function
+
+import json
+import os
+import socket
+import struct
+import subprocess
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "octoprint_networkmanager"))
+
+import dbus
+import dbus.service
+
+from nmcli import Nmcli, CommandTarget
+from dbusnmcli import DbusNmcli, NM_BUS_NAME, NM_PATH, NM_SETTINGS_PATH, NM_IFACE, NM_DEVICE_IFACE, \
+    NM_WIRED_IFACE, NM_WIRELESS_IFACE, NM_ACCESS_POINT_IFACE, NM_ACTIVE_CONNECTION_IFACE, NM_IP4_CONFIG_IFACE, \
+    NM_SETTINGS_IFACE, NM_CONNECTION_IFACE, PROPERTIES_IFACE
+
+WIRED_UUID = "0a4c9b0e-3c5f-4b7e-9a41-4b8d2f1e6c01"
+HOME_UUID = "5d1f2a7c-8e3b-4c6d-a9f0-1b2c3d4e5f60"
+CAFE_UUID = "9e8d7c6b-5a49-4382-b1a0-f9e8d7c6b5a4"
+
+# The configured connections. The active wifi profile is not named after its SSID, and the SSID has the
+# characters nmcli escapes.
+CONNECTIONS = [
+    dict(id="Wired connection 1", uuid=WIRED_UUID, type="802-3-ethernet", autoconnect=True, method="auto"),
+    dict(id="preconfigured", uuid=HOME_UUID, type="802-11-wireless", autoconnect=True, ssid="Home: 5G \\ net",
+         psk="s3cr3t:psk", method="manual", addresses=[("192.168.1.21", 24, "192.168.1.1")], dns=["8.8.8.8", "1.1.1.1"]),
+    dict(id="Café", uuid=CAFE_UUID, type="802-11-wireless", autoconnect=False, ssid="Café", psk="", method="auto"),
+]
+
+# The network devices with NMDeviceType, NMDeviceState, the active connection and its address.
+# eth0 has its MAC address on the wired interface only, like NetworkManager < 1.2.
+DEVICES = [
+    dict(interface="lo", type=32, nmcli_type="loopback", state=10, state_name="unmanaged", hwaddr="00:00:00:00:00:00"),
+    dict(interface="eth0", type=1, nmcli_type="ethernet", state=100, state_name="connected", hwaddr="B8:27:EB:00:00:01",
+         connection=WIRED_UUID, address=("192.168.1.20", 24, "192.168.1.1"), hwaddr_on_device=False),
+    dict(interface="wlan0", type=2, nmcli_type="wifi", state=100, state_name="connected", hwaddr="B8:27:EB:00:00:02",
+         connection=HOME_UUID, address=("192.168.1.21", 24, "192.168.1.1")),
+]
+
+# The access points wlan0 sees: ssid, bssid, strength, NM80211ApFlags, WPA and RSN NM80211ApSecurityFlags, and the
+# security the way nmcli lists it
+ACCESS_POINTS = [
+    ("Home: 5G \\ net", "AA:BB:CC:00:00:01", 82, 0x1, 0, 0x108, "WPA2"),
+    ("Home: 5G \\ net", "AA:BB:CC:00:00:02", 40, 0x1, 0, 0x108, "WPA2"),
+    ("Office", "AA:BB:CC:00:00:03", 67, 0x1, 0x108, 0x108, "WPA1 WPA2"),
+    ("Legacy", "AA:BB:CC:00:00:04", 30, 0x1, 0, 0, "WEP"),
+    ("Guest", "AA:BB:CC:00:00:05", 55, 0, 0, 0, ""),
+    ("Campus", "AA:BB:CC:00:00:06", 48, 0x1, 0, 0x208, "WPA2 802.1X"),
+    ("Modern", "AA:BB:CC:00:00:07", 71, 0x1, 0, 0x408, "WPA3"),
+    ("Café", "AA:BB:CC:00:00:08", 20, 0, 0, 0, ""),
+]
+
+DEVICE_PATH = NM_PATH + "/Devices/{0}"
+ACCESS_POINT_PATH = NM_PATH + "/AccessPoint/{0}"
+ACTIVE_CONNECTION_PATH = NM_PATH + "/ActiveConnection/{0}"
+IP4_CONFIG_PATH = NM_PATH + "/IP4Config/{0}"
+CONNECTION_PATH = NM_SETTINGS_PATH + "/{0}"
+
+
+def ip_to_int(ip):
+    # NetworkManager sends addresses as a uint32 in network byte order
+    return struct.unpack("=I", socket.inet_aton(ip))[0]
+
+
+def get_connection(uuid):
+    for index, connection in enumerate(CONNECTIONS):
+        if connection["uuid"] == uuid:
+            return index, connection
+    return None, None
+
+
+##~~ The nmcli side
+
+def escape_terse(value):
+    return value.replace("\\", "\\\\").replace(":", "\\:")
+
+
+def format_address(address):
+    return "ip = {0}/{1}, gw = {2}".format(*address)
+
+
+class ModelCommands(object):
+    """
+    Answers the nmcli and dbus-send commands from the model, mixed into both backends
+    """
+
+    def _run_command(self, command, target, timeout):
+        if target == CommandTarget.DBUS:
+            return self._get_secrets(command)
+
+        if "--version" in command:
+            return 0, "nmcli tool, version 0.9.10.0"
+        if command == Nmcli.WIFI_LIST_COMMAND:
+            return 0, self._wifi_list()
+        if command == Nmcli.CONNECTIONS_COMMAND:
+            return 0, self._connection_list()
+        if command[:4] == ["-t", "-f", "GENERAL,IP4,CONNECTIONS", "dev"]:
+            return 0, self._dev_show()
+        if command[:3] == ["-t", "con", "show"]:
+            return self._con_show(command[3:])
+
+        return 1, "Error: {0} is not in the model".format(command)
+
+    def _wifi_list(self):
+        return "".join("{0}:{1}:{2}:{3}\n".format(escape_terse(ssid), escape_terse(bssid), strength, security)
+                       for ssid, bssid, strength, _, _, _, security in ACCESS_POINTS)
+
+    def _connection_list(self):
+        return "".join("{0}:{1}:{2}:{3}:{4}\n".format(escape_terse(connection["id"]), connection["uuid"], connection["type"],
+                                                      "yes" if connection["autoconnect"] else "no",
+                                                      escape_terse(CONNECTION_PATH.format(index)))
+                       for index, connection in enumerate(CONNECTIONS))
+
+    def _dev_show(self):
+        records = []
+
+        for device in DEVICES:
+            _, connection = get_connection(device.get("connection"))
+
+            lines = [
+                "GENERAL.DEVICE:{0}".format(device["interface"]),
+                "GENERAL.TYPE:{0}".format(device["nmcli_type"]),
+                "GENERAL.HWADDR:{0}".format(escape_terse(device["hwaddr"])),
+                "GENERAL.STATE:{0} ({1})".format(device["state"], device["state_name"]),
+                "GENERAL.CONNECTION:{0}".format(escape_terse(connection["id"]) if connection else "--"),
+                "GENERAL.CON-UUID:{0}".format(connection["uuid"] if connection else "--")
+            ]
+            if device.get("address"):
+                lines.append("IP4.ADDRESS[1]:{0}".format(format_address(device["address"])))
+
+            records.append("\n".join(lines))
+
+        return "\n\n".join(records) + "\n"
+
+    def _con_show(self, ids):
+        blocks = []
+
+        for id in ids:
+            index, connection = get_connection(id)
+            if connection is None:
+                return 10, "Error: {0} - no such connection profile.".format(id)
+
+            lines = [
+                "connection.id:{0}".format(escape_terse(connection["id"])),
+                "connection.uuid:{0}".format(connection["uuid"]),
+                "connection.type:{0}".format(connection["type"]),
+                "connection.autoconnect:{0}".format("yes" if connection["autoconnect"] else "no")
+            ]
+            if "ssid" in connection:
+                lines.append("802-11-wireless.ssid:{0}".format(escape_terse(connection["ssid"])))
+            lines += [
+                "ipv4.method:{0}".format(connection["method"]),
+                "ipv4.dns:{0}".format(", ".join(connection.get("dns", []))),
+                "ipv4.addresses:{0}".format("; ".join("{ " + format_address(address) + " }" for address in connection.get("addresses", [])))
+            ]
+
+            for device in DEVICES:
+                if device.get("connection") == connection["uuid"]:
+                    lines.append("IP4.ADDRESS[1]:{0}".format(format_address(device["address"])))
+
+            blocks.append("\n".join(lines))
+
+        return 0, "\n\n".join(blocks)
+
+    def _get_secrets(self, command):
+        for index, connection in enumerate(CONNECTIONS):
+            if CONNECTION_PATH.format(index) in command:
+                secrets = ""
+                if connection.get("psk"):
+                    secrets = """
+            dict entry(
+               string "psk"
+               variant                   string "{0}"
+            )""".format(connection["psk"])
+
+                return 0, """method return time=1500000000.000000 sender=:1.3 -> destination=:1.80 serial=1234 reply_serial=2
+   array [
+      dict entry(
+         string "802-11-wireless-security"
+         array [{0}
+         ]
+      )
+   ]
+""".format(secrets)
+
+        return 1, "Error org.freedesktop.DBus.Error.UnknownObject: No such object path"
+
+
+class ModelNmcli(ModelCommands, Nmcli):
+    pass
+
+
+class ModelDbusNmcli(ModelCommands, DbusNmcli):
+    pass
+
+
+##~~ The D-Bus side
+
+class MockObject(dbus.service.Object):
+    """
+    An object of the mock NetworkManager with the properties by interface
+    """
+
+    def __init__(self, bus, path, properties):
+        dbus.service.Object.__init__(self, bus, path)
+        self.properties = properties
+
+    @dbus.service.method(PROPERTIES_IFACE, in_signature="ss", out_signature="v")
+    def Get(self, interface, name):
+        return self.properties[interface][name]
+
+    @dbus.service.method(PROPERTIES_IFACE, in_signature="s", out_signature="a{sv}")
+    def GetAll(self, interface):
+        return dbus.Dictionary(self.properties.get(interface, {}), signature="sv")
+
+
+class MockNetworkManager(MockObject):
+    def __init__(self, bus, devices, active_connections):
+        MockObject.__init__(self, bus, NM_PATH, {
+            NM_IFACE: {
+                "ActiveConnections": dbus.Array(active_connections, signature="o"),
+                "Version": "0.9.10.0"
+            }
+        })
+        self.devices = devices
+
+    @dbus.service.method(NM_IFACE, in_signature="", out_signature="ao")
+    def GetDevices(self):
+        return self.devices
+
+
+class MockDevice(MockObject):
+    def __init__(self, bus, path, properties, access_points):
+        MockObject.__init__(self, bus, path, properties)
+        self.access_points = access_points
+
+    @dbus.service.method(NM_WIRELESS_IFACE, in_signature="", out_signature="ao")
+    def GetAllAccessPoints(self):
+        return self.access_points
+
+    @dbus.service.method(NM_WIRELESS_IFACE, in_signature="a{sv}", out_signature="")
+    def RequestScan(self, options):
+        pass
+
+
+class MockSettings(MockObject):
+    def __init__(self, bus, connections):
+        MockObject.__init__(self, bus, NM_SETTINGS_PATH, {})
+        self.connections = connections
+
+    @dbus.service.method(NM_SETTINGS_IFACE, in_signature="", out_signature="ao")
+    def ListConnections(self):
+        return self.connections
+
+
+class MockConnection(MockObject):
+    def __init__(self, bus, path, connection):
+        MockObject.__init__(self, bus, path, {})
+        self.connection = connection
+
+    @dbus.service.method(NM_CONNECTION_IFACE, in_signature="", out_signature="a{sa{sv}}")
+    def GetSettings(self):
+        connection = self.connection
+
+        settings = {
+            "connection": dbus.Dictionary({
+                "id": connection["id"],
+                "uuid": connection["uuid"],
+                "type": connection["type"],
+                "autoconnect": dbus.Boolean(connection["autoconnect"])
+            }, signature="sv"),
+            "ipv4": dbus.Dictionary({
+                "method": connection["method"],
+                "dns": dbus.Array([dbus.UInt32(ip_to_int(dns)) for dns in connection.get("dns", [])], signature="u"),
+                "addresses": dbus.Array([dbus.Array([dbus.UInt32(ip_to_int(ip)), dbus.UInt32(prefix), dbus.UInt32(ip_to_int(gateway))], signature="u")
+                                         for ip, prefix, gateway in connection.get("addresses", [])], signature="au")
+            }, signature="sv")
+        }
+        if "ssid" in connection:
+            settings["802-11-wireless"] = dbus.Dictionary({
+                "ssid": dbus.ByteArray(connection["ssid"])
+            }, signature="sv")
+
+        return dbus.Dictionary(settings, signature="sa{sv}")
+
+    @dbus.service.method(NM_CONNECTION_IFACE, in_signature="s", out_signature="a{sa{sv}}")
+    def GetSecrets(self, setting):
+        secrets = {}
+        if self.connection.get("psk"):
+            secrets["psk"] = self.connection["psk"]
+
+        return dbus.Dictionary({ setting: dbus.Dictionary(secrets, signature="sv") }, signature="sa{sv}")
+
+
+def export_model(bus):
+    """
+    Exports the model as NetworkManager objects, returns them so they stay alive
+    """
+    objects = []
+
+    access_points = []
+    for index, (ssid, bssid, strength, flags, wpa_flags, rsn_flags, _) in enumerate(ACCESS_POINTS):
+        path = ACCESS_POINT_PATH.format(index)
+        objects.append(MockObject(bus, path, {
+            NM_ACCESS_POINT_IFACE: {
+                "Ssid": dbus.ByteArray(ssid),
+                "HwAddress": bssid,
+                "Strength": dbus.Byte(strength),
+                "Flags": dbus.UInt32(flags),
+                "WpaFlags": dbus.UInt32(wpa_flags),
+                "RsnFlags": dbus.UInt32(rsn_flags)
+            }
+        }))
+        access_points.append(dbus.ObjectPath(path))
+
+    connections = []
+    for index, connection in enumerate(CONNECTIONS):
+        path = CONNECTION_PATH.format(index)
+        objects.append(MockConnection(bus, path, connection))
+        connections.append(dbus.ObjectPath(path))
+    objects.append(MockSettings(bus, dbus.Array(connections, signature="o")))
+
+    devices = []
+    active_connections = []
+    for index, device in enumerate(DEVICES):
+        path = DEVICE_PATH.format(index)
+        active_path = ip4_path = "/"
+
+        if device.get("address"):
+            ip4_path = IP4_CONFIG_PATH.format(index)
+            ip, prefix, gateway = device["address"]
+            objects.append(MockObject(bus, ip4_path, {
+                NM_IP4_CONFIG_IFACE: {
+                    "Addresses": dbus.Array([dbus.Array([dbus.UInt32(ip_to_int(ip)), dbus.UInt32(prefix), dbus.UInt32(ip_to_int(gateway))], signature="u")], signature="au")
+                }
+            }))
+
+        if device.get("connection"):
+            active_path = ACTIVE_CONNECTION_PATH.format(index)
+            connection_index, connection = get_connection(device["connection"])
+            objects.append(MockObject(bus, active_path, {
+                NM_ACTIVE_CONNECTION_IFACE: {
+                    "Uuid": connection["uuid"],
+                    "Connection": dbus.ObjectPath(CONNECTION_PATH.format(connection_index)),
+                    "Ip4Config": dbus.ObjectPath(ip4_path)
+                }
+            }))
+            active_connections.append(dbus.ObjectPath(active_path))
+
+        properties = {
+            NM_DEVICE_IFACE: {
+                "Interface": device["interface"],
+                "DeviceType": dbus.UInt32(device["type"]),
+                "State": dbus.UInt32(device["state"]),
+                "ActiveConnection": dbus.ObjectPath(active_path),
+                "Ip4Config": dbus.ObjectPath(ip4_path)
+            },
+            NM_WIRED_IFACE: { "HwAddress": device["hwaddr"] },
+            NM_WIRELESS_IFACE: { "HwAddress": device["hwaddr"] }
+        }
+        if device.get("hwaddr_on_device", True):
+            properties[NM_DEVICE_IFACE]["HwAddress"] = device["hwaddr"]
+
+        objects.append(MockDevice(bus, path, properties, dbus.Array(access_points if device["type"] == 2 else [], signature="o")))
+        devices.append(dbus.ObjectPath(path))
+
+    objects.append(MockNetworkManager(bus, dbus.Array(devices, signature="o"), active_connections))
+    return objects
+
+
+def serve(address):
+    """
+    Runs the mock NetworkManager service on the bus at address until it is killed
+    """
+    import dbus.mainloop.glib
+    try:
+        from gi.repository import GLib
+    except ImportError:
+        import gobject as GLib
+
+    dbus.mainloop.glib.DBusGMainLoop(set_as_default=True)
+
+    bus = dbus.bus.BusConnection(address)
+    name = dbus.service.BusName(NM_BUS_NAME, bus)
+    objects = export_model(bus)
+
+    print("ready")
+    sys.stdout.flush()
+
+    GLib.MainLoop().run()
+
+
+##~~ The check
+
+CHECKS = [
+    ("get_status", lambda nmcli: nmcli.get_status()),
+    ("scan_wifi", lambda nmcli: nmcli.scan_wifi()),
+    ("get_configured_connections", lambda nmcli: nmcli.get_configured_connections()),
+    ("get_configured_connection_details_many", lambda nmcli: nmcli.get_configured_connection_details_many()),
+] + [
+    ("get_configured_connection_details({0})".format(connection["id"]),
+     lambda nmcli, uuid=connection["uuid"]: nmcli.get_configured_connection_details(uuid))
+    for connection in CONNECTIONS
+]
+
+
+def canonical(result):
+    """
+    The JSON the plugin would send, lists in a fixed order as the backends don't keep the same one
+    """
+    if isinstance(result, list):
+        return "[" + ",".join(sorted(json.dumps(item, sort_keys=True) for item in result)) + "]"
+    return json.dumps(result, sort_keys=True)
+
+
+def start_bus():
+    daemon = subprocess.Popen(["dbus-daemon", "--session", "--nofork", "--print-address"], stdout=subprocess.PIPE)
+    address = daemon.stdout.readline().strip()
+    if not address:
+        raise SystemExit("dbus-daemon did not start")
+    return daemon, address
+
+
+def start_service(address):
+    service = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--serve", address], stdout=subprocess.PIPE)
+    if service.stdout.readline().strip() != "ready":
+        raise SystemExit("The mock NetworkManager service did not start")
+    return service
+
+
+def main():
+    if sys.argv[1:2] == ["--serve"]:
+        serve(sys.argv[2])
+        return
+
+    daemon, address = start_bus()
+    service = None
+
+    try:
+        service = start_service(address)
+
+        nmcli = ModelNmcli()
+        dbus_nmcli = ModelDbusNmcli(bus_address=address)
+
+        differences = []
+        for name, check in CHECKS:
+            expected = canonical(check(nmcli))
+            actual = canonical(check(dbus_nmcli))
+
+            if expected == actual:
+                print("{0:<60} same".format(name))
+            else:
+                print("{0:<60} DIFFERENT".format(name))
+                print("    nmcli: {0}".format(expected))
+                print("    D-Bus: {0}".format(actual))
+                differences.append(name)
+    finally:
+        if service:
+            service.kill()
+        daemon.kill()
+
+    if differences:
+        print("DbusNmcli differs from the nmcli parsing in: {0}".format(", ".join(differences)))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,252 @@
+# coding=utf-8
+"""
+Load harness for the plugin's blueprint. Runs NetworkManagerPlugin on the mocked NetworkManager in a bare Flask
+app and drives its routes through Flask test clients from many threads:
+
+- browser tabs that poll GET / with their wifi revision and ETag, like the settings page does
+- monitoring systems that poll GET / without any of these
+- an admin that starts wifi scans and saves connection details
+
+It reports the throughput, the p50/p95/p99 latency per route and the most nmcli commands that ran at once.
+Needs OctoPrint and Flask, like the plugin itself.
+
+    python benchmarks/load_blueprint.py [--tabs 20] [--monitors 1] [--duration 10] [--latency 0.05] ...
+"""
+from __future__ import print_function
+
+import argparse
+import collections
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from flask import Flask
+
+from octoprint_networkmanager import NetworkManagerPlugin
+
+PREFIX = "/plugin/networkmanager"
+
+
+class HarnessSettings(object):
+    """
+    The part of OctoPrint's plugin settings the plugin uses, answered from its defaults and overrides
+    """
+
+    def __init__(self, defaults, overrides):
+        self._values = json.loads(json.dumps(defaults))
+        for path, value in overrides.items():
+            node = self._values
+            for key in path[:-1]:
+                node = node.setdefault(key, {})
+            node[path[-1]] = value
+
+    def get(self, path):
+        node = self._values
+        for key in path:
+            if not isinstance(node, dict) or key not in node:
+                return None
+            node = node[key]
+        return node
+
+    def get_int(self, path):
+        value = self.get(path)
+        return int(value) if value is not None else None
+
+    def get_float(self, path):
+        value = self.get(path)
+        return float(value) if value is not None else None
+
+    def get_boolean(self, path):
+        return bool(self.get(path))
+
+
+class HarnessPluginManager(object):
+    def __init__(self):
+        self.messages = 0
+
+    def send_plugin_message(self, identifier, data):
+        self.messages += 1
+
+
+class Recorder(object):
+    """
+    Collects the latency of every request by route
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = collections.defaultdict(list)
+        self.statuses = collections.defaultdict(collections.Counter)
+
+    def request(self, client, route, method, url, **kwargs):
+        started = time.time()
+        response = getattr(client, method)(url, **kwargs)
+        latency = time.time() - started
+
+        with self._lock:
+            self.latencies[route].append(latency)
+            self.statuses[route][response.status_code] += 1
+
+        return response
+
+
+def percentile(values, fraction):
+    index = int(round(fraction * (len(values) - 1)))
+    return values[index]
+
+
+def create_plugin(args, data_folder):
+    plugin = NetworkManagerPlugin()
+
+    plugin._identifier = "networkmanager"
+    plugin._plugin_name = "NetworkManager"
+    plugin._plugin_version = "load"
+    plugin._basefolder = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "octoprint_networkmanager")
+    plugin._logger = logging.getLogger("octoprint.plugins.networkmanager")
+    plugin._plugin_manager = HarnessPluginManager()
+    plugin._settings = HarnessSettings(plugin.get_settings_defaults(), {
+        ("mock", "enabled"): True,
+        ("mock", "seed"): args.seed,
+        ("mock", "access_points"): args.access_points,
+        ("mock", "profiles"): args.profiles,
+        ("mock", "latency"): args.latency,
+        ("max_processes",): args.max_processes,
+        ("max_queue",): args.max_queue,
+    })
+    plugin.get_plugin_data_folder = lambda: data_folder
+
+    plugin.initialize()
+    if args.monitor:
+        plugin.on_after_startup()
+    else:
+        plugin._start_warm_up()
+
+    # Measure the running plugin, not its warm-up
+    while not plugin._backend_ready.wait(0.1):
+        if plugin._backend_error:
+            raise SystemExit("The backend did not start: {0}".format(plugin._backend_error))
+    return plugin
+
+
+def browser_tab(app, recorder, stop, interval):
+    # Polls with the wifi revision and ETag of its last answer, like networkmanager.js
+    client = app.test_client()
+    revision = None
+    etag = None
+
+    while not stop.is_set():
+        url = PREFIX + "/" + ("?since={0}".format(revision) if revision is not None else "")
+        headers = { "If-None-Match": etag } if etag else {}
+
+        response = recorder.request(client, "GET / (tab)", "get", url, headers=headers)
+        if response.status_code == 200:
+            etag = response.headers.get("ETag")
+            revision = json.loads(response.get_data(as_text=True)).get("revision")
+
+        stop.wait(interval)
+
+
+def monitoring_system(app, recorder, stop, interval):
+    client = app.test_client()
+
+    while not stop.is_set():
+        recorder.request(client, "GET / (monitor)", "get", PREFIX + "/")
+        stop.wait(interval)
+
+
+def admin(app, plugin, recorder, stop, interval):
+    client = app.test_client()
+
+    while not stop.is_set():
+        recorder.request(client, "POST /wifi/scan", "post", PREFIX + "/wifi/scan")
+
+        connection = plugin.nmcli.connections[-1]
+        details = dict(ssid=connection.ssid, psk="secret", isWireless=True, autoconnect=True,
+                       ipv4=dict(method="auto", ip=None, gateway=None, dns=[]))
+        recorder.request(client, "POST /connection_details/<id>", "post",
+                         PREFIX + "/connection_details/" + connection.uuid,
+                         data=json.dumps(dict(details=details, interface="wifi")),
+                         content_type="application/json")
+
+        stop.wait(interval)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Drives the NetworkManager blueprint from many threads")
+    parser.add_argument("--tabs", type=int, default=20, help="Browser tabs polling GET /")
+    parser.add_argument("--monitors", type=int, default=1, help="Monitoring systems polling GET /")
+    parser.add_argument("--admins", type=int, default=1, help="Admins scanning and saving connections")
+    parser.add_argument("--duration", type=float, default=10, help="Seconds to run")
+    parser.add_argument("--interval", type=float, default=0.1, help="Seconds between the requests of a poller")
+    parser.add_argument("--admin-interval", type=float, default=1, help="Seconds between the admin's changes")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--access-points", type=int, default=200)
+    parser.add_argument("--profiles", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.05, help="Seconds every mocked nmcli command takes")
+    parser.add_argument("--max-processes", type=int, default=2)
+    parser.add_argument("--max-queue", type=int, default=16)
+    parser.add_argument("--monitor", action="store_true", help="Start the network monitor, as OctoPrint does after startup")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR)
+    data_folder = tempfile.mkdtemp()
+
+    try:
+        plugin = create_plugin(args, data_folder)
+
+        app = Flask(__name__)
+        app.register_blueprint(plugin.get_blueprint(), url_prefix=PREFIX)
+
+        recorder = Recorder()
+        stop = threading.Event()
+
+        workers = []
+        workers += [threading.Thread(target=browser_tab, args=(app, recorder, stop, args.interval)) for _ in range(args.tabs)]
+        workers += [threading.Thread(target=monitoring_system, args=(app, recorder, stop, args.interval)) for _ in range(args.monitors)]
+        workers += [threading.Thread(target=admin, args=(app, plugin, recorder, stop, args.admin_interval)) for _ in range(args.admins)]
+
+        started = time.time()
+        for worker in workers:
+            worker.daemon = True
+            worker.start()
+
+        time.sleep(args.duration)
+        stop.set()
+        for worker in workers:
+            worker.join()
+        elapsed = time.time() - started
+
+        if args.monitor:
+            plugin.on_shutdown()
+    finally:
+        shutil.rmtree(data_folder, ignore_errors=True)
+
+    total = sum(len(latencies) for latencies in recorder.latencies.values())
+    print("{0} requests in {1:.1f} s, {2:.1f} requests/s".format(total, elapsed, total / elapsed))
+    print()
+    print("{0:<32} {1:>8} {2:>8} {3:>8} {4:>8} {5:>8}  {6}".format("route", "requests", "req/s", "p50 ms", "p95 ms", "p99 ms", "statuses"))
+
+    for route in sorted(recorder.latencies):
+        latencies = sorted(recorder.latencies[route])
+        statuses = ", ".join("{0}: {1}".format(status, count) for status, count in sorted(recorder.statuses[route].items()))
+        print("{0:<32} {1:>8} {2:>8.1f} {3:>8.1f} {4:>8.1f} {5:>8.1f}  {6}".format(
+            route, len(latencies), len(latencies) / elapsed,
+            percentile(latencies, 0.5) * 1000, percentile(latencies, 0.95) * 1000, percentile(latencies, 0.99) * 1000,
+            statuses))
+
+    print()
+    print("Most nmcli commands at once: {0} (max_processes {1})".format(plugin.nmcli.peak_commands, args.max_processes))
+    print("Coalesced reads: {0}, connection cache hits/misses: {hits}/{misses}".format(
+        plugin.nmcli.coalesced_commands, **plugin.nmcli.connection_cache_stats))
+    print("Socket messages pushed: {0}".format(plugin._plugin_manager.messages))
+
+
+if __name__ == "__main__":
+    main()
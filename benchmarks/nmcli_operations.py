@@ -0,0 +1,199 @@
+# coding=utf-8
+"""
+Runs every public Nmcli operation against MockingNmcli and reports its wall time, memory and the number of
+commands it sends. Exits with 1 when an operation sends more commands than its budget, so a change that makes
+the settings page fork more nmcli processes gets caught.
+
+    python benchmarks/nmcli_operations.py [--iterations N] [--budget operation=commands ...]
+
+Every iteration starts with an empty connection cache and no memoized profile SSIDs, so the counts are those of a
+cold call. The operations that depend on the wifi state run once more with the wifi connected.
+The memory column is the peak traced memory of a call where tracemalloc is available (Python 3). Python 2 has no
+way to count allocations, there the column is the net change in objects tracked by the garbage collector: the
+containers a call leaves behind, not what it allocated and freed on the way. The header says which one it is.
+"""
+from __future__ import print_function
+
+import argparse
+import gc
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "octoprint_networkmanager"))
+
+from mockingnmcli import MockingNmcli
+
+try:
+    import tracemalloc
+    MEMORY_COLUMN = "peak KiB"
+except ImportError:
+    tracemalloc = None
+    MEMORY_COLUMN = "net gc objects"
+
+
+# The most commands an operation may send
+BUDGETS = {
+    "get_status": 1,
+    "get_status(wifi connected)": 2,
+    "scan_wifi": 3,
+    "scan_wifi(force)": 4,
+    "get_configured_connections": 1,
+    "get_configured_connection_details": 3,
+    "get_configured_connection_details_many": 2,
+    "add_wifi_connection": 3,
+    "set_configured_connection_details": 3,
+}
+
+
+def wifi_details(ssid):
+    return dict(ssid=ssid, psk="secret", isWireless=True, autoconnect=True,
+                ipv4=dict(method="auto", ip=None, gateway=None, dns=[]))
+
+
+OPERATIONS = [
+    ("get_status", lambda nmcli: nmcli.get_status()),
+    ("scan_wifi", lambda nmcli: nmcli.scan_wifi()),
+    ("scan_wifi(force)", lambda nmcli: nmcli.scan_wifi(force=True)),
+    ("get_configured_connections", lambda nmcli: nmcli.get_configured_connections()),
+    ("get_configured_connection_details", lambda nmcli: nmcli.get_configured_connection_details(nmcli.connections[-1].uuid)),
+    ("get_configured_connection_details_many", lambda nmcli: nmcli.get_configured_connection_details_many()),
+    ("add_wifi_connection", lambda nmcli: nmcli.add_wifi_connection(nmcli.wifis[1].ssid, "secret")),
+    ("set_configured_connection_details", lambda nmcli: nmcli.set_configured_connection_details("wifi", wifi_details(nmcli.wifis[2].ssid), nmcli.connections[-1].uuid)),
+]
+
+
+# Operations that run once more against a mock with its wifi connected
+CONNECTED_OPERATIONS = [
+    ("get_status(wifi connected)", lambda nmcli: nmcli.get_status()),
+]
+
+
+def connect_wifi(nmcli):
+    connection = next(connection for connection in nmcli.connections if "wireless" in connection.type)
+    returncode, _ = nmcli._send_command(["con", "up", connection.uuid])
+    if returncode != 0 or not nmcli.get_status()["wifi"]["connected"]:
+        raise SystemExit("Could not connect the mocked wifi")
+
+
+def reset(nmcli):
+    # The SSIDs of the profiles are memoized next to the connection cache, a cold call has neither
+    nmcli.invalidate_configured_connections()
+    nmcli._connection_ssids = {}
+
+
+class CommandCounter(object):
+    """
+    Counts the commands an Nmcli instance sends, by wrapping its _send_command
+    """
+
+    def __init__(self, nmcli):
+        self.count = 0
+        self._send_command = nmcli._send_command
+        nmcli._send_command = self
+
+    def __call__(self, *args, **kwargs):
+        self.count += 1
+        return self._send_command(*args, **kwargs)
+
+
+def measure_memory(operation, nmcli):
+    """
+    Returns the peak memory in KiB (tracemalloc) or the net change in gc tracked objects of one call of operation,
+    see MEMORY_COLUMN
+    """
+    if tracemalloc:
+        tracemalloc.start()
+        operation(nmcli)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return "{0:.1f}".format(peak / 1024.0)
+
+    gc.collect()
+    gc.disable()
+    try:
+        before = len(gc.get_objects())
+        operation(nmcli)
+        return "{0:+d}".format(len(gc.get_objects()) - before)
+    finally:
+        gc.enable()
+
+
+def run(name, operation, nmcli, counter, iterations):
+    # Warm up, so the first call doesn't pay for imports and regex compilation
+    reset(nmcli)
+    operation(nmcli)
+
+    times = []
+    commands = 0
+    for _ in range(iterations):
+        reset(nmcli)
+        counter.count = 0
+
+        started = time.time()
+        operation(nmcli)
+        times.append(time.time() - started)
+
+        commands = max(commands, counter.count)
+
+    reset(nmcli)
+    memory = measure_memory(operation, nmcli)
+
+    times.sort()
+    return dict(name=name,
+                mean=sum(times) / len(times),
+                median=times[len(times) // 2],
+                commands=commands,
+                memory=memory)
+
+
+def parse_budgets(values):
+    budgets = dict(BUDGETS)
+    for value in values or []:
+        name, _, commands = value.partition("=")
+        if name not in budgets:
+            raise SystemExit("Unknown operation {0}, known are: {1}".format(name, ", ".join(sorted(budgets))))
+        budgets[name] = int(commands)
+    return budgets
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks the Nmcli operations against MockingNmcli")
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--budget", action="append", metavar="OPERATION=COMMANDS",
+                        help="Overrides the command budget of an operation")
+    args = parser.parse_args()
+
+    budgets = parse_budgets(args.budget)
+
+    logging.disable(logging.CRITICAL)
+
+    nmcli = MockingNmcli(seed=0)
+    connected = MockingNmcli(seed=0)
+    connect_wifi(connected)
+
+    print("{0:<40} {1:>10} {2:>10} {3:>9} {4:>16}".format("operation", "mean ms", "median ms", "commands", MEMORY_COLUMN))
+
+    over_budget = []
+    for mock, operations in [(nmcli, OPERATIONS), (connected, CONNECTED_OPERATIONS)]:
+        counter = CommandCounter(mock)
+        for name, operation in operations:
+            result = run(name, operation, mock, counter, args.iterations)
+
+            budget = budgets.get(name)
+            flag = ""
+            if budget is not None and result["commands"] > budget:
+                over_budget.append(name)
+                flag = "  over budget of {0}".format(budget)
+
+            print("{name:<40} {0:>10.3f} {1:>10.3f} {commands:>9} {memory:>16}{2}".format(
+                result["mean"] * 1000, result["median"] * 1000, flag, **result))
+
+    if over_budget:
+        print("Command budget exceeded by: {0}".format(", ".join(over_budget)))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+# coding=utf-8
+"""
+Benchmarks the parser for nmcli terse output (-t) against the character by character parser it replaced, and
+checks that both give the same fields for a corpus of escaped lines.
+
+    python benchmarks/parse_terse.py [lines] [repeat]
+"""
+from __future__ import print_function
+
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "octoprint_networkmanager"))
+
+from nmcli import split_terse_line
+
+
+def reference_split_esc(string, delimiter):
+    """The parser before the fast one, kept as the reference for equivalence"""
+    ln = len(string)
+    i = 0
+    j = 0
+
+    while j < ln:
+        if string[j] == '\\':
+            if j + 1 >= ln:
+                yield string[i:j]
+                return
+            j += 1
+        elif string[j] == delimiter:
+            yield string[i:j]
+            i = j + 1
+        j += 1
+    yield string[i:j]
+
+
+def reference_split_terse_line(line):
+    return [item.replace("\\:", ":").replace("\\\\", "\\") for item in reference_split_esc(line, ":")]
+
+
+EDGE_CASES = [
+    "",
+    ":",
+    "::",
+    "a",
+    "a:",
+    ":a",
+    "a:b:c",
+    "\\",
+    "a\\",
+    "a\\\\",
+    "a\\\\\\",
+    "a\\:b",
+    "a\\\\:b",
+    "a\\\\\\:b",
+    "a\\:",
+    "a\\::b",
+    "\\:\\:\\:",
+    "a\\:b\\",
+    "a:b\\",
+    "a\\x:b",
+    "\\\\\\\\:\\\\",
+    "My\\:Net\\\\work:AA\\:BB\\:CC\\:DD\\:EE\\:FF:70:WPA2",
+    "caf\xc3\xa9:00\\:11\\:22\\:33\\:44\\:55:12:",
+    "a\x00b\\:c:d\\",
+    "\x01\\\\:\\\x00",
+]
+
+
+def escape(value):
+    return value.replace("\\", "\\\\").replace(":", "\\:")
+
+
+def wifi_corpus(lines, seed = 1):
+    """Lines like the ones of dev wifi list, some SSIDs have escaped characters"""
+    rng = random.Random(seed)
+    corpus = []
+
+    for i in range(lines):
+        ssid = "Network {0}".format(i)
+        if i % 10 == 0:
+            ssid = "Net:{0}\\work".format(i)
+
+        bssid = ":".join("{0:02X}".format(rng.randint(0, 255)) for _ in range(6))
+        security = rng.choice(["", "WPA1", "WPA2", "WPA1 WPA2", "WEP"])
+        corpus.append(":".join([escape(ssid), escape(bssid), str(rng.randint(0, 100)), security]))
+
+    return corpus
+
+
+def connection_corpus(lines, seed = 2):
+    """Lines like the ones of con show, nothing escaped"""
+    rng = random.Random(seed)
+    return ["Connection {0}:{1:032x}:802-11-wireless:{2}:/org/freedesktop/NetworkManager/Settings/{0}".format(
+                i, rng.getrandbits(128), rng.choice(["yes", "no"])) for i in range(lines)]
+
+
+def random_corpus(lines, seed = 3):
+    """Random lines made of the characters that matter to the parser"""
+    rng = random.Random(seed)
+    return ["".join(rng.choice("ab:\\\x00") for _ in range(rng.randint(0, 12))) for _ in range(lines)]
+
+
+def check_equivalence(corpus):
+    for line in corpus:
+        expected = reference_split_terse_line(line)
+        actual = split_terse_line(line)
+        if actual != expected:
+            raise AssertionError("{0!r}: expected {1!r}, got {2!r}".format(line, expected, actual))
+
+
+def bench(name, corpus, repeat):
+    reference = min(timeit.repeat(lambda: [reference_split_terse_line(line) for line in corpus], number=1, repeat=repeat))
+    fast = min(timeit.repeat(lambda: [split_terse_line(line) for line in corpus], number=1, repeat=repeat))
+
+    print("{0:<12} {1:>7} lines  reference {2:8.2f} ms  fast {3:8.2f} ms  {4:6.1f}x".format(
+        name, len(corpus), reference * 1000, fast * 1000, reference / fast))
+
+
+def main():
+    lines = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+    corpora = [
+        ("wifi list", wifi_corpus(lines)),
+        ("con show", connection_corpus(lines)),
+        ("random", random_corpus(lines)),
+    ]
+
+    check_equivalence(EDGE_CASES)
+    for name, corpus in corpora:
+        check_equivalence(corpus)
+    print("Equivalence: {0} edge cases and {1} corpus lines match".format(len(EDGE_CASES), lines * len(corpora)))
+
+    for name, corpus in corpora:
+        bench(name, corpus, repeat)
+
+
+if __name__ == "__main__":
+    main()
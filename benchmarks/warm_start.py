@@ -0,0 +1,128 @@
+# coding=utf-8
+"""
+Checks the warm start of the plugin's blueprint where OctoPrint mounts it, below /plugin/networkmanager, and at
+the root. Writes a snapshot, starts NetworkManagerPlugin on it in a bare Flask app and keeps the backend starting,
+then checks that:
+
+- GET / and GET /connections answer from the snapshot, marked stale
+- the routes without the backend, /traces and /profiles, don't answer 503
+- the routes that need the backend answer 503 initializing
+
+Exits with 1 when one of them doesn't. Needs OctoPrint and Flask, like the plugin itself.
+
+    python benchmarks/warm_start.py
+"""
+from __future__ import print_function
+
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from flask import Flask
+
+from octoprint_networkmanager import NetworkManagerPlugin
+from octoprint_networkmanager.state import NetworkState, write_snapshot
+from load_blueprint import HarnessSettings, HarnessPluginManager
+
+PREFIXES = ["/plugin/networkmanager", ""]
+
+STATUS = dict(
+    ethernet=dict(connected=False, enabled=True, ip=None, connection_uuid=None, mac_address="B8:27:EB:00:00:01", ssid=None),
+    wifi=dict(connected=True, enabled=True, ip="192.168.1.21", connection_uuid="5d1f2a7c-8e3b-4c6d-a9f0-1b2c3d4e5f60",
+              mac_address="B8:27:EB:00:00:02", ssid="Home")
+)
+WIFIS = [dict(ssid="Home", bssid="AA:BB:CC:00:00:01", bssids=["AA:BB:CC:00:00:01"], signal=82, security="WPA2",
+              connection_uuid="5d1f2a7c-8e3b-4c6d-a9f0-1b2c3d4e5f60")]
+CONNECTIONS = [dict(uuid="5d1f2a7c-8e3b-4c6d-a9f0-1b2c3d4e5f60", name="Home", ssid="Home", isWireless=True, autoconnect=True)]
+
+
+def write_test_snapshot(data_folder):
+    state = NetworkState()
+    state.update(STATUS, WIFIS)
+    state.update_connections(CONNECTIONS)
+    write_snapshot(os.path.join(data_folder, "snapshot.json.gz"), state.snapshot())
+
+
+def create_plugin(data_folder):
+    plugin = NetworkManagerPlugin()
+
+    plugin._identifier = "networkmanager"
+    plugin._plugin_name = "NetworkManager"
+    plugin._plugin_version = "warm_start"
+    plugin._basefolder = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "octoprint_networkmanager")
+    plugin._logger = logging.getLogger("octoprint.plugins.networkmanager")
+    plugin._plugin_manager = HarnessPluginManager()
+    plugin._settings = HarnessSettings(plugin.get_settings_defaults(), {
+        ("mock", "enabled"): True,
+        ("mock", "seed"): 1
+    })
+    plugin.get_plugin_data_folder = lambda: data_folder
+
+    # The backend keeps starting for the whole check
+    plugin._start_warm_up = lambda: None
+
+    plugin.initialize()
+    return plugin
+
+
+def check_prefix(prefix, data_folder):
+    """
+    Returns the failed checks with the blueprint mounted at prefix
+    """
+    plugin = create_plugin(data_folder)
+    if not plugin._state.stale:
+        return ["the snapshot was not restored"]
+
+    app = Flask(__name__)
+    app.register_blueprint(plugin.get_blueprint(), url_prefix=prefix or None)
+    client = app.test_client()
+
+    failures = []
+
+    def check(route, passed, response, expected):
+        status = "ok" if passed else "FAILED"
+        print("{0:<24} {1:<44} {2:>4}  {3}".format(prefix or "(root)", route, response.status_code, status))
+        if not passed:
+            failures.append("{0}{1} answered {2}, expected {3}".format(prefix, route, response.status_code, expected))
+
+    for route in ["/", "/connections"]:
+        response = client.get(prefix + route)
+        data = json.loads(response.get_data(as_text=True)) if response.status_code == 200 else {}
+        check(route + " (snapshot)", response.status_code == 200 and data.get("stale") is True, response, "200 and stale")
+
+    for route in ["/traces", "/profiles"]:
+        response = client.get(prefix + route)
+        check(route + " (without backend)", response.status_code != 503, response, "no 503")
+
+    for route in ["/connection_details/wifi", "/metrics"]:
+        response = client.get(prefix + route)
+        check(route + " (needs backend)", response.status_code == 503, response, "503")
+
+    return failures
+
+
+def main():
+    logging.basicConfig(level=logging.ERROR)
+
+    failures = []
+    for prefix in PREFIXES:
+        data_folder = tempfile.mkdtemp()
+        try:
+            write_test_snapshot(data_folder)
+            failures += check_prefix(prefix, data_folder)
+        finally:
+            shutil.rmtree(data_folder, ignore_errors=True)
+
+    if failures:
+        print()
+        print("\n".join(failures))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
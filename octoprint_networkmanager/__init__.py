@@ -6,38 +6,360 @@ __license__ = 'GNU Affero General Public License http://www.gnu.org/licenses/agp
 __copyright__ = "Copyright (C) 2014 The OctoPrint Project - Released under terms of the AGPLv3 License"
 
 import octoprint.plugin
+import json
+import os
 import sys
+import threading
+import time
 
 from octoprint.server import admin_permission
-from flask import jsonify, make_response, request
-from .nmcli import Nmcli
+from octoprint.util import RepeatedTimer
+from flask import Response, g, jsonify, make_response, request, send_from_directory, stream_with_context
+from .nmcli import Nmcli, NmcliError
+from .jobs import OperationQueue, ScanJobs, WifiReset
+from .metrics import Metrics
+from .monitor import NetworkMonitor
+from .profiling import Profiler
+from .state import NetworkState, read_snapshot, write_snapshot
+
+
+# Methods that become spans of a request trace when tracing is enabled
+TRACED_PLUGIN_METHODS = ["_refresh_state", "_get_status", "_get_wifi_list", "_get_connection_details",
+                         "_get_configured_connections_details"]
+TRACED_NMCLI_METHODS = ["get_status", "get_devices", "get_interfaces", "_get_mac_address", "_get_interface_ip",
+                        "scan_wifi", "rescan_wifi", "get_configured_connections", "_read_configured_connections",
+                        "get_configured_connection_details", "get_configured_connection_details_many", "_get_psk"]
+
+
+# Views that manage the profiles, they are not profiled themselves
+PROFILE_VIEWS = ["get_profiles", "start_profiling", "stop_profiling", "download_profile"]
+
+# Views that answer without the backend, while it is still starting. Views and not routes, OctoPrint mounts the
+# blueprint below a prefix
+BACKEND_FREE_VIEWS = ["get_traces"] + PROFILE_VIEWS
+
+# Views that answer from the snapshot of the last run while the backend is starting
+SNAPSHOT_VIEWS = ["get_status", "get_connections"]
 
 
 class NetworkManagerPlugin(octoprint.plugin.SettingsPlugin,
                            octoprint.plugin.AssetPlugin,
                            octoprint.plugin.TemplatePlugin,
-                           octoprint.plugin.BlueprintPlugin):
+                           octoprint.plugin.BlueprintPlugin,
+                           octoprint.plugin.StartupPlugin,
+                           octoprint.plugin.ShutdownPlugin):
 
 
     ##~~ Init
     def __init__(self):
-        self.ncmli = None
+        self.nmcli = None
         self.mocking = sys.platform == "win32" or sys.platform == "darwin"
 
+        self._state = NetworkState()
+        self._monitor = None
+        self._refresh_timer = None
+        self._snapshot_timer = None
+        self._snapshot_path = None
+        self._snapshot_etag = None
+        self._snapshot_mac_addresses = {}
+        self._wifi_reset = None
+        self._operations = OperationQueue(self._on_operation_changed)
+        self._scan_jobs = ScanJobs(lambda: self._get_wifi_list(force=True), self._on_scan_done, operations=self._operations)
+        self._metrics = Metrics()
+        self._command_observers = [self._metrics.observe_command]
+        self._capture = None
+        self._tracer = None
+        self._profiler = None
+
+        # The backend is created by a warm-up thread, so OctoPrint's startup doesn't wait for nmcli
+        self._backend_ready = threading.Event()
+        self._backend_error = None
+        self._backend_lock = threading.Lock()
+        self._warm_up_thread = None
+        self._started = False
+
     def initialize(self):
-        if self.mocking:
+        self._profiler = Profiler(os.path.join(self.get_plugin_data_folder(), "profiles"),
+                                  keep=self._settings.get_int(["profiling", "keep"]))
+
+        if self._settings.get_boolean(["record"]):
+            self._start_capture()
+        if self._settings.get_boolean(["tracing", "enabled"]):
+            self._start_tracing()
+
+        if self._settings.get_boolean(["snapshot", "enabled"]):
+            self._snapshot_path = os.path.join(self.get_plugin_data_folder(), "snapshot.json.gz")
+            self._restore_snapshot()
+
+    def _restore_snapshot(self):
+        """
+        Answers with the state of the last run until the backend has a current one
+        """
+        try:
+            snapshot = read_snapshot(self._snapshot_path)
+        except (IOError, ValueError) as e:
+            self._logger.warn("Could not read the snapshot {0}: {1}".format(self._snapshot_path, e))
+            return
+
+        if snapshot is None:
+            return
+
+        self._state.restore(snapshot)
+        self._snapshot_etag = self._state.etag
+        self._snapshot_mac_addresses = snapshot.get("mac_addresses") or {}
+        self._logger.info("Restored the network state of {0:.0f} s ago".format(time.time() - snapshot["time"]))
+
+    def _save_snapshot(self):
+        snapshot = self._state.snapshot()
+        if snapshot is None or not self._snapshot_path:
+            return
+
+        # MAC addresses don't change, the next run doesn't have to ask for them again
+        if self.nmcli:
+            snapshot["mac_addresses"] = dict((device, mac) for device, mac in self.nmcli.mac_addresses.items() if mac)
+
+        try:
+            write_snapshot(self._snapshot_path, snapshot)
+            self._snapshot_etag = self._state.etag
+        except (IOError, OSError) as e:
+            self._logger.warn("Could not write the snapshot {0}: {1}".format(self._snapshot_path, e))
+
+    def _on_snapshot_timer(self):
+        # Only write to the SD card when the state changed
+        if self._state.etag != self._snapshot_etag:
+            self._save_snapshot()
+
+    def _start_warm_up(self):
+        """
+        Creates the backend in the background, once
+        """
+        with self._backend_lock:
+            if self._warm_up_thread:
+                return
+
+            self._warm_up_thread = threading.Thread(target=self._warm_up, name="NetworkManager warm-up")
+            self._warm_up_thread.daemon = True
+            self._warm_up_thread.start()
+
+    def _warm_up(self):
+        started = time.time()
+
+        try:
+            nmcli = self._create_backend()
+        except Exception as e:
+            self._logger.exception("Could not start the NetworkManager backend")
+            self._backend_error = str(e)
+            return
+
+        for device, mac in self._snapshot_mac_addresses.items():
+            if mac and not nmcli.mac_addresses.get(device):
+                nmcli.mac_addresses[device] = mac
+
+        self.nmcli = nmcli
+        self._wifi_reset = WifiReset(self.nmcli, self._on_reset_changed, operations=self._operations)
+
+        if self._tracer:
+            self._tracer.instrument(self.nmcli, TRACED_NMCLI_METHODS)
+            self._tracer.instrument(self, TRACED_PLUGIN_METHODS)
+
+        with self._backend_lock:
+            self._backend_ready.set()
+            start_monitor = self._started
+
+        self._logger.info("NetworkManager backend ready after {0:.2f} s".format(time.time() - started))
+
+        if start_monitor:
+            self._start_monitor()
+
+        # Bring the state restored from the snapshot up to date, clients get it pushed
+        if self._state.stale:
+            self._on_network_changed()
+
+            try:
+                self._state.update_connections(self._get_configured_connections_details())
+            except Exception as e:
+                self._logger.exception("Error while refreshing the configured connections: {0}".format(e))
+
+    def _create_backend(self):
+        mock_options = self._get_mock_options()
+
+        if self.mocking or mock_options is not None:
             import octoprint_networkmanager.mockingnmcli
-            self.nmcli = octoprint_networkmanager.mockingnmcli.MockingNmcli()
+            self._logger.info("Using the mocked NetworkManager")
+            return octoprint_networkmanager.mockingnmcli.MockingNmcli(**dict(self._get_backend_options(), **(mock_options or {})))
+        elif self._settings.get(["backend"]) == "dbus":
+            return self._create_dbus_backend()
+        elif self._settings.get(["backend"]) == "replay":
+            from .replaynmcli import ReplayNmcli
+            return ReplayNmcli(self._settings.get(["replay", "capture"]),
+                               realtime=self._settings.get_boolean(["replay", "realtime"]),
+                               **self._get_backend_options())
         else:
-            self.nmcli = Nmcli()
+            return Nmcli(**self._get_backend_options())
+
+    def _create_dbus_backend(self):
+        try:
+            from .dbusnmcli import DbusNmcli
+        except ImportError:
+            self._logger.warn("The dbus backend requires dbus-python, falling back to nmcli")
+            return Nmcli(**self._get_backend_options())
+
+        return DbusNmcli(bus_address=self._settings.get(["dbus_address"]), **self._get_backend_options())
+
+    def _get_backend_options(self):
+        return dict(
+            connection_cache_ttl=self._settings.get_float(["connection_cache_ttl"]),
+            timeout=self._settings.get_float(["timeout"]),
+            max_processes=self._settings.get_int(["max_processes"]),
+            max_queue=self._settings.get_int(["max_queue"]),
+            streaming=self._settings.get_boolean(["streaming"]),
+            command_observers=self._command_observers
+        )
+
+    def _start_capture(self):
+        """
+        Records every nmcli command with its output to a capture file in the data folder, for ReplayNmcli
+        """
+        from .capture import CaptureWriter
+
+        folder = os.path.join(self.get_plugin_data_folder(), "captures")
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+
+        path = os.path.join(folder, "nmcli-{0}.jsonl".format(time.strftime("%Y%m%d-%H%M%S")))
+        self._capture = CaptureWriter(path)
+        self._command_observers.append(self._capture)
+        self._logger.info("Recording nmcli commands to {0}".format(path))
+
+    def _start_tracing(self):
+        """
+        Traces every blueprint request to a rotating file of JSON lines in the data folder
+        """
+        from .tracing import Tracer
+
+        path = os.path.join(self.get_plugin_data_folder(), "traces.jsonl")
+        self._tracer = Tracer(path,
+                              max_bytes=self._settings.get_int(["tracing", "max_bytes"]),
+                              backup_count=self._settings.get_int(["tracing", "backups"]),
+                              keep=self._settings.get_int(["tracing", "keep"]))
+        self._command_observers.append(self._tracer.observe_command)
+        self._logger.info("Tracing requests to {0}".format(path))
+
+    def _get_mock_options(self):
+        """
+        Returns the MockingNmcli options when the mock is turned on by the mock setting or the NETWORKMANAGER_MOCK
+        environment variable, None otherwise. The variable is either 1 or a list of options that override the
+        settings, like seed=1,access_points=2000,profiles=300,latency=0.05
+        """
+        environment = os.environ.get("NETWORKMANAGER_MOCK", "")
+        if not self._settings.get_boolean(["mock", "enabled"]) and environment.lower() in ["", "0", "false", "no"]:
+            return None
+
+        options = dict(
+            seed=self._settings.get_int(["mock", "seed"]),
+            devices=self._settings.get_int(["mock", "devices"]),
+            access_points=self._settings.get_int(["mock", "access_points"]),
+            profiles=self._settings.get_int(["mock", "profiles"]),
+            latency=self._settings.get_float(["mock", "latency"]),
+            failure_rate=self._settings.get_float(["mock", "failure_rate"])
+        )
+
+        for option in environment.split(","):
+            if "=" not in option:
+                continue
+
+            key, value = [part.strip() for part in option.split("=", 1)]
+            if key not in options:
+                self._logger.warn("Unknown mock option {0}".format(key))
+                continue
+            options[key] = float(value) if key in ["latency", "failure_rate"] else int(value)
+
+        return options
 
     ##~~ SettingsPlugin mixin
 
     def get_settings_defaults(self):
         return dict(
-            timeout=10
+            timeout=10,
+            backend="nmcli",
+            dbus_address=None,
+            refresh_interval=60,
+            connection_cache_ttl=5,
+            max_processes=2,
+            max_queue=16,
+            streaming=False,
+            record=False,
+            tracing=dict(
+                enabled=False,
+                max_bytes=1024 * 1024,
+                backups=3,
+                keep=100
+            ),
+            profiling=dict(
+                keep=20
+            ),
+            snapshot=dict(
+                enabled=True,
+                interval=300
+            ),
+            replay=dict(
+                capture=None,
+                realtime=False
+            ),
+            mock=dict(
+                enabled=False,
+                seed=None,
+                devices=2,
+                access_points=20,
+                profiles=2,
+                latency=0,
+                failure_rate=0
+            )
         )
 
+    ##~~ StartupPlugin mixin
+
+    def on_after_startup(self):
+        # The monitor starts with the backend, or right away when a request already warmed it up
+        with self._backend_lock:
+            self._started = True
+            start_monitor = self._backend_ready.is_set()
+
+        if start_monitor:
+            self._start_monitor()
+        else:
+            self._start_warm_up()
+
+    def _start_monitor(self):
+        self._monitor = NetworkMonitor(self.nmcli, self._on_network_changed)
+        self._monitor.start()
+
+        # nmcli monitor does not report access points coming and going, so refresh the state periodically as well
+        self._refresh_timer = RepeatedTimer(self._settings.get_int(["refresh_interval"]), self._on_network_changed)
+        self._refresh_timer.start()
+
+        if self._snapshot_path:
+            self._snapshot_timer = RepeatedTimer(self._settings.get_int(["snapshot", "interval"]), self._on_snapshot_timer)
+            self._snapshot_timer.start()
+
+    ##~~ ShutdownPlugin mixin
+
+    def on_shutdown(self):
+        with self._backend_lock:
+            self._started = False
+
+        if self._refresh_timer:
+            self._refresh_timer.cancel()
+        if self._snapshot_timer:
+            self._snapshot_timer.cancel()
+        self._save_snapshot()
+        if self._monitor:
+            self._monitor.stop()
+        if self._capture:
+            self._capture.close()
+        if self._tracer:
+            self._tracer.close()
+
     ##~~ AssetPlugin mixin
 
     def get_assets(self):
@@ -59,23 +381,183 @@ class NetworkManagerPlugin(octoprint.plugin.SettingsPlugin,
 
     ##~~ BlueprintPlugin mixin
 
+    def get_blueprint(self):
+        blueprint = super(NetworkManagerPlugin, self).get_blueprint()
+
+        # The blueprint is created once and cached, register the timing hooks only once as well
+        if not getattr(blueprint, "networkmanager_timed", False):
+            blueprint.before_request(self._before_request)
+            blueprint.after_request(self._after_request)
+            blueprint.teardown_request(self._teardown_request)
+            blueprint.networkmanager_timed = True
+
+        return blueprint
+
+    def _before_request(self):
+        g.networkmanager_started = time.time()
+        route = self._get_route()
+        view = self._get_view()
+
+        if self._tracer:
+            self._tracer.start_request(route, request.method)
+
+        # Managing the profiles does not use up the requests to profile
+        if self._profiler and view not in PROFILE_VIEWS:
+            self._profiler.start_request(route, request.method)
+
+        if not self._backend_ready.is_set() and view not in BACKEND_FREE_VIEWS:
+            if not (self._state.stale and view in SNAPSHOT_VIEWS):
+                return self._make_initializing_response()
+
+            # Answer from the snapshot, requests before OctoPrint's startup finished still warm up the backend
+            if not self._backend_error:
+                self._start_warm_up()
+
+    def _make_initializing_response(self):
+        """
+        Answers requests that need the backend while it is starting, or why it didn't
+        """
+        if self._backend_error:
+            return make_response(jsonify(dict(status="failed", error=self._backend_error)), 503)
+
+        # Requests before OctoPrint's startup finished warm up the backend themselves
+        self._start_warm_up()
+
+        response = make_response(jsonify(dict(status="initializing")), 503)
+        response.headers["Retry-After"] = "1"
+        return response
+
+    def _after_request(self, response):
+        g.networkmanager_status = response.status_code
+
+        trace = self._tracer.current if self._tracer else None
+        if trace:
+            response.headers["X-Correlation-Id"] = trace.id
+
+        return response
+
+    def _teardown_request(self, exception = None):
+        # Runs after views that raised as well, where after_request is skipped
+        started = getattr(g, "networkmanager_started", None)
+        status = 500 if exception is not None else getattr(g, "networkmanager_status", 500)
+
+        if self._profiler:
+            self._profiler.finish_request()
+
+        if self._tracer:
+            self._tracer.finish_request(status)
+
+        if started is not None:
+            self._metrics.observe_request(self._get_route(), request.method, status, time.time() - started)
+
+    def _get_route(self):
+        # Route templates, not the URLs, so ids don't create a series each
+        return request.url_rule.rule if request.url_rule else "unmatched"
+
+    def _get_view(self):
+        # The name of the view function, the endpoint without the blueprint's name
+        return request.endpoint.rsplit(".", 1)[-1] if request.endpoint else None
+
+    @octoprint.plugin.BlueprintPlugin.route("/traces", methods=["GET"])
+    def get_traces(self):
+        if not admin_permission.can():
+            return make_response(jsonify({ "message": "Insufficient rights"}), 403)
+        if not self._tracer:
+            return make_response(jsonify({ "message": "Tracing is disabled"}), 404)
+
+        # The slowest of the recent requests, with their spans
+        limit = request.args.get("limit", 10, type=int)
+        return jsonify(traces=self._tracer.slowest(limit))
+
+    @octoprint.plugin.BlueprintPlugin.route("/profiles", methods=["GET"])
+    def get_profiles(self):
+        if not admin_permission.can():
+            return make_response(jsonify({ "message": "Insufficient rights"}), 403)
+
+        return jsonify(profiles=self._profiler.list_profiles(), **self._profiler.as_dict())
+
+    @octoprint.plugin.BlueprintPlugin.route("/profiles", methods=["POST"])
+    def start_profiling(self):
+        """
+        Profiles the next requests, or those in the next seconds, with cProfile
+        """
+        if not admin_permission.can():
+            return make_response(jsonify({ "message": "Insufficient rights"}), 403)
+
+        data = request.json or {}
+        try:
+            requests = int(data.get("requests") or 0)
+            seconds = float(data.get("seconds") or 0)
+        except (TypeError, ValueError):
+            return make_response(jsonify({ "message": "requests and seconds have to be numbers"}), 400)
+
+        if requests <= 0 and seconds <= 0:
+            return make_response(jsonify({ "message": "Either requests or seconds is required"}), 400)
+
+        self._profiler.arm(requests=requests, seconds=seconds)
+        return jsonify(self._profiler.as_dict())
+
+    @octoprint.plugin.BlueprintPlugin.route("/profiles", methods=["DELETE"])
+    def stop_profiling(self):
+        if not admin_permission.can():
+            return make_response(jsonify({ "message": "Insufficient rights"}), 403)
+
+        self._profiler.disarm()
+        return jsonify(self._profiler.as_dict())
+
+    @octoprint.plugin.BlueprintPlugin.route("/profiles/<string:name>", methods=["GET"])
+    def download_profile(self, name):
+        if not admin_permission.can():
+            return make_response(jsonify({ "message": "Insufficient rights"}), 403)
+        if name not in [profile["name"] for profile in self._profiler.list_profiles()]:
+            return make_response(jsonify({ "message": "Unknown profile"}), 404)
+
+        return send_from_directory(self._profiler.folder, name, as_attachment=True,
+                                   mimetype="application/octet-stream")
+
+    @octoprint.plugin.BlueprintPlugin.route("/metrics", methods=["GET"])
+    def get_metrics(self):
+        if not admin_permission.can():
+            return make_response(jsonify({ "message": "Insufficient rights"}), 403)
+
+        values = [
+            ("networkmanager_nmcli_active_commands", "gauge", "Commands running right now", self.nmcli.active_commands),
+            ("networkmanager_nmcli_peak_commands", "gauge", "Most commands that ran at once", self.nmcli.peak_commands),
+            ("networkmanager_nmcli_rejected_commands_total", "counter", "Commands that were not run because too many were waiting", self.nmcli.rejected_commands),
+            ("networkmanager_nmcli_coalesced_commands_total", "counter", "Reads that shared the result of an identical running read", self.nmcli.coalesced_commands),
+            ("networkmanager_connection_cache_hits_total", "counter", "Configured connections answered from the cache", self.nmcli.connection_cache_stats["hits"]),
+            ("networkmanager_connection_cache_misses_total", "counter", "Configured connections read from NetworkManager", self.nmcli.connection_cache_stats["misses"])
+        ]
+
+        response = make_response(self._metrics.render(values))
+        response.headers["Content-Type"] = "text/plain; version=0.0.4; charset=utf-8"
+        return response
+
     @octoprint.plugin.BlueprintPlugin.route("/", methods=["GET"])
     def get_status(self):
-        status = None
-        wifis = []
+        # Clients that pass the revision of their wifi list only get the changes since
+        since = request.args.get("since", None, type=int)
 
         try:
-            status = self._get_status()
-            if status and "wifi" in status and status["wifi"]["enabled"]:
-                wifis = self._get_wifi_list()  
+            # Answer from memory while the monitor keeps the state current, or from the snapshot while the backend starts
+            if self._backend_ready.is_set() and (not self._monitor or not self._monitor.alive or not self._state.valid):
+                self._refresh_state()
         except Exception as e:
             self._logger.exception(e.message)
             return jsonify(dict(error=e.message))
 
-        return jsonify(dict(
-            wifis=wifis,
-            status=status
-        ))
+        # Clients that already have this state get an empty 304. The tag is weak, the body is sent gzip compressed
+        # or not, and If-None-Match compares weakly anyway
+        etag = self._state.get_etag(since)
+        if etag and request.if_none_match.contains_weak(etag):
+            response = make_response("", 304)
+        else:
+            response = self._make_payload_response(self._state.get_payload(since))
+
+        if etag:
+            response.set_etag(etag, weak=True)
+        response.headers["Cache-Control"] = "no-cache"
+        return response
 
     @octoprint.plugin.BlueprintPlugin.route("/connection_details/<string:id>", methods=["GET"])
     def get_connection_details(self, id):
@@ -89,6 +571,16 @@ class NetworkManagerPlugin(octoprint.plugin.SettingsPlugin,
         connection_details = self._get_connection_details(id)
         return make_response(jsonify(details=connection_details), 200)
 
+    @octoprint.plugin.BlueprintPlugin.route("/connections", methods=["GET"])
+    def get_connections(self):
+        if not self._backend_ready.is_set():
+            return make_response(jsonify(connections=self._state.connections or [], stale=True,
+                                         age=time.time() - self._state.updated), 200)
+
+        connections = self._get_configured_connections_details()
+        self._state.update_connections(connections)
+        return make_response(jsonify(connections=connections), 200)
+
     @octoprint.plugin.BlueprintPlugin.route("/connection_details/<string:id>", methods=["POST"])
     def set_connection_details(self, id):
         # Override id with an interface name
@@ -99,31 +591,64 @@ class NetworkManagerPlugin(octoprint.plugin.SettingsPlugin,
 
         connection_details = request.json["details"]
         interface = request.json["interface"]
-        if self._set_connection_details(id, interface, connection_details):
-            return make_response(jsonify(), 200)
-        else:
-            return make_response(jsonify(), 400)
+
+        return self._queue_operation("Save connection details",
+                                     lambda: self._set_connection_details(id, interface, connection_details))
 
 
     @octoprint.plugin.BlueprintPlugin.route("/wifi/enable", methods=["POST"])
     def enable_wifi(self):
-        if self._set_wifi_enabled(True):
-            self._logger.info("Wifi radio enabled")
-            return jsonify()
-        else:
-            return make_response(jsonify(), 400)
+        return self._queue_operation("Enable wifi radio", lambda: self._set_wifi_enabled(True))
 
     @octoprint.plugin.BlueprintPlugin.route("/wifi/disable", methods=["POST"])
     def disable_wifi(self):
-        self._set_wifi_enabled(False)
-        self._logger.info("Wifi radio disabled")
-        return jsonify()
+        return self._queue_operation("Disable wifi radio", lambda: self._set_wifi_enabled(False))
 
     @octoprint.plugin.BlueprintPlugin.route("/wifi/scan", methods=["POST"])
     def scan_wifi(self):
-        wifis = self._get_wifi_list(force=True)
+        job = self._scan_jobs.start()
         self._logger.info("Wifi scan initiated")
-        return jsonify(dict(wifis=wifis))
+        return make_response(jsonify(job.as_dict()), 202)
+
+    @octoprint.plugin.BlueprintPlugin.route("/wifi/scan/<string:id>", methods=["GET"])
+    def get_scan(self, id):
+        job = self._scan_jobs.get(id)
+        if not job:
+            return make_response(jsonify({ "message": "Unknown scan"}), 404)
+
+        return jsonify(job.as_dict())
+
+    @octoprint.plugin.BlueprintPlugin.route("/wifi/stream", methods=["GET"])
+    def stream_wifi(self):
+        """
+        Sends every access point as a line of JSON as soon as it is parsed, followed by a line with the time it
+        took to the first access point. Duplicate SSIDs are not filtered, that is left to the browser.
+        Only lists what NetworkManager knows, rescans are started as scan jobs with POST /wifi/scan.
+        """
+        def generate():
+            cells = []
+
+            try:
+                for cell in self.nmcli.iter_wifi_cells():
+                    cells.append(cell)
+                    yield json.dumps(dict(wifi=self._format_wifi(dict(cell, bssids=[cell["bssid"]])))) + "\n"
+            except NmcliError as e:
+                self._logger.warn("Error while streaming the wifi list: {0}".format(e))
+                yield json.dumps(dict(error=str(e))) + "\n"
+                return
+
+            # The whole list is known now, bring the state and the other clients up to date
+            wifis = [self._format_wifi(cell) for cell in self.nmcli._filter_cells(cells)]
+            self._send_changes(self._state.update_wifis(wifis))
+
+            stats = self.nmcli.scan_stats
+            yield json.dumps(dict(done=True,
+                                  count=stats["count"],
+                                  firstAccessPoint=stats["first_access_point"],
+                                  duration=stats["duration"])) + "\n"
+
+        return Response(stream_with_context(generate()), mimetype="application/x-ndjson",
+                        headers={"Cache-Control": "no-cache"})
 
     @octoprint.plugin.BlueprintPlugin.route("/wifi/configure", methods=["POST"])
     def configure_wifi(self):
@@ -137,26 +662,96 @@ class NetworkManagerPlugin(octoprint.plugin.SettingsPlugin,
             self._logger.info("Configuring wifi {ssid}...".format(**data))
             data['psk'] = None
 
-        result = self.nmcli.add_wifi_connection(ssid=data["ssid"], psk=data["psk"])
-
-        if result:
-            return make_response(jsonify(connection_uuid=result), 200)
-        else:
-            return make_response(jsonify(), 400)
+        return self._queue_operation("Configure wifi {ssid}".format(**data),
+                                     lambda: self._add_wifi_connection(data["ssid"], data["psk"]))
 
     @octoprint.plugin.BlueprintPlugin.route("/wifi/disconnect", methods=["POST"])
     def disconnect_wifi(self):
         if not admin_permission.can():
             return make_response(jsonify({ "message": "Insufficient rights"}), 403)
 
-        return self._disconnect_wifi()
+        return self._queue_operation("Disconnect wifi", self._disconnect_wifi)
+
+    @octoprint.plugin.BlueprintPlugin.route("/operations/<string:id>", methods=["GET"])
+    def get_operation(self, id):
+        operation = self._operations.get(id)
+        if not operation:
+            return make_response(jsonify({ "message": "Unknown operation"}), 404)
+
+        return jsonify(operation.as_dict())
 
     @octoprint.plugin.BlueprintPlugin.route("/wifi/reset", methods=["POST"])
     def reset_wifi(self):
         if not admin_permission.can():
             return make_response(jsonify({ "message": "Insufficient rights"}), 403)
-        self._reset_wifi()
-        return make_response(jsonify(), 200)
+
+        # A reset that is already running is not restarted
+        if self._wifi_reset.start():
+            return make_response(jsonify(self._wifi_reset.as_dict()), 202)
+        return make_response(jsonify(self._wifi_reset.as_dict()), 200)
+
+    @octoprint.plugin.BlueprintPlugin.route("/wifi/reset", methods=["GET"])
+    def get_reset_wifi(self):
+        return jsonify(self._wifi_reset.as_dict())
+
+    def _make_payload_response(self, payload):
+        """
+        Sends the serialized payload as is, compressed if the client accepts gzip
+        """
+        if request.accept_encodings["gzip"]:
+            response = make_response(payload.gzip)
+            response.headers["Content-Encoding"] = "gzip"
+        else:
+            response = make_response(payload.json)
+
+        response.mimetype = "application/json"
+        response.vary.add("Accept-Encoding")
+        return response
+
+    ##~~ Operations
+
+    def _queue_operation(self, name, function):
+        """
+        Queues a change for the operation worker and returns its id, status can be followed on /operations/<id>
+        """
+        operation = self._operations.submit(name, function)
+        return make_response(jsonify(operation.as_dict()), 202)
+
+    def _on_operation_changed(self, operation):
+        self._send_changes(dict(operation=operation.as_dict()))
+
+    ##~~ Network state
+
+    def _on_network_changed(self):
+        try:
+            self._refresh_state()
+        except Exception as e:
+            self._logger.exception("Error while refreshing network state: {0}".format(e))
+
+    def _refresh_state(self):
+        status = self._get_status()
+        wifis = []
+
+        if status and "wifi" in status and status["wifi"]["enabled"]:
+            wifis = self._get_wifi_list()
+
+        self._send_changes(self._state.update(status, wifis))
+        return status, wifis
+
+    def _on_scan_done(self, job):
+        if job.wifis is not None:
+            self._send_changes(self._state.update_wifis(job.wifis))
+
+    def _on_reset_changed(self, status):
+        self._state.invalidate()
+        self._send_changes(dict(reset=status))
+
+    def _send_changes(self, changes):
+        """
+        Pushes changed status and wifi list to the frontend
+        """
+        if changes:
+            self._plugin_manager.send_plugin_message(self._identifier, changes)
 
     ##~~ Private functions to retrieve info
 
@@ -166,8 +761,13 @@ class NetworkManagerPlugin(octoprint.plugin.SettingsPlugin,
     def _get_connection_details(self, uuid):
         return self.nmcli.get_configured_connection_details(uuid)
 
+    def _get_configured_connections_details(self):
+        return self.nmcli.get_configured_connection_details_many(read_psk=False)
+
     def _set_connection_details(self, uuid, interface, new_settings):
-        return self.nmcli.set_configured_connection_details(interface, new_settings, uuid)
+        result = self.nmcli.set_configured_connection_details(interface, new_settings, uuid)
+        self._state.invalidate()
+        return result
         
     def _get_wifi_list(self, force=False):
         result = []
@@ -175,14 +775,18 @@ class NetworkManagerPlugin(octoprint.plugin.SettingsPlugin,
         content = self.nmcli.scan_wifi(force=force)
         if content:
             for wifi in content:
-                result.append({ "ssid": wifi["ssid"], 
-                               "signal": wifi["signal"], 
-                               "security": wifi["security"] if "security" in wifi else None,
-                               "connectionUuid": wifi["connection_uuid"]
-                               })
+                result.append(self._format_wifi(wifi))
         
         return result
 
+    def _format_wifi(self, wifi):
+        return { "ssid": wifi["ssid"], 
+                 "bssids": wifi.get("bssids", []),
+                 "signal": wifi["signal"], 
+                 "security": wifi["security"] if "security" in wifi else None,
+                 "connectionUuid": wifi["connection_uuid"]
+                 }
+
     def _get_configured_connections(self):
         content = self.nmcli.get_configured_connections()
         result = []
@@ -192,24 +796,32 @@ class NetworkManagerPlugin(octoprint.plugin.SettingsPlugin,
         self._logger.info(result)
         return result
 
+    def _add_wifi_connection(self, ssid, psk):
+        result = self.nmcli.add_wifi_connection(ssid=ssid, psk=psk)
+        self._state.invalidate()
+
+        return result or False
+
     def _disconnect_wifi(self):
         disconnected = self.nmcli.disconnect_interface('wifi')
+        self._state.invalidate()
         if not disconnected:
-            return make_response(jsonify({"message":"An error occured while disconnecting." }), 400)
-        return make_response(jsonify({"message":"Succesful disconnect" }), 200)
+            self._logger.error("An error occured while disconnecting.")
+        return bool(disconnected)
 
 
     def _delete_configured_connection(self, uuid):
-        return self.nmcli.delete_configured_connection(uuid)
+        result = self.nmcli.delete_configured_connection(uuid)
+        self._state.invalidate()
+        return result
 
     def _set_wifi_enabled(self, enabled):
         result = self.nmcli.set_wifi_radio(enabled)
-        
-        return result
+        self._state.invalidate()
 
-    def _reset_wifi(self):
-        self.nmcli.reset_wifi()
-        self.nmcli.rescan_wifi()
+        if result:
+            self._logger.info("Wifi radio {0}".format("enabled" if enabled else "disabled"))
+        return result
 
     ##~~ Softwareupdate hook
 
@@ -0,0 +1,94 @@
+# coding=utf-8
+import json
+import logging
+import re
+import threading
+import time
+
+REDACTED = "<redacted>"
+
+# Arguments that are followed by a secret
+SECRET_ARGUMENTS = ["password", "802-11-wireless-security.psk", "wifi-sec.psk"]
+
+# Output patterns with the secret between the groups, and their replacements
+SECRET_OUTPUT = [
+    # con show --show-secrets
+    (re.compile(r"^(802-11-wireless-security\.psk:).*$", re.MULTILINE), r"\1" + REDACTED),
+    # dbus-send GetSecrets
+    (re.compile(r"(variant\s+string \")[^\"]*(\")"), r"\1" + REDACTED + r"\2")
+]
+
+
+def redact_command(command):
+    """
+    Returns the command with the secrets replaced by a placeholder
+    """
+    result = list(command)
+    for i in range(1, len(result)):
+        if result[i - 1] in SECRET_ARGUMENTS:
+            result[i] = REDACTED
+    return result
+
+
+def redact_output(output):
+    if not output:
+        return output
+
+    for pattern, replacement in SECRET_OUTPUT:
+        output = pattern.sub(replacement, output)
+    return output
+
+
+class CaptureWriter(object):
+    """
+    Command observer that appends every command, its exit code, output and latency to a capture file,
+    one JSON object per line. Secrets are redacted.
+    """
+
+    def __init__(self, path):
+        self.logger = logging.getLogger("octoprint.plugins.networkmanager.capture")
+
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = open(path, "a")
+
+    def __call__(self, target, command, returncode, output, latency):
+        line = json.dumps(dict(
+            time=time.time(),
+            target=target,
+            command=redact_command(command),
+            returncode=returncode,
+            output=redact_output(output),
+            latency=latency
+        ))
+
+        with self._lock:
+            if self._file:
+                self._file.write(line + "\n")
+                self._file.flush()
+
+    def close(self):
+        with self._lock:
+            if self._file:
+                self._file.close()
+                self._file = None
+
+
+def read_capture(path):
+    """
+    Returns the entries of a capture file in the order they were recorded
+    """
+    entries = []
+
+    with open(path) as f:
+        for number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                logging.getLogger("octoprint.plugins.networkmanager.capture").warn("Skipping unreadable line {0} of {1}".format(number, path))
+
+    return entries
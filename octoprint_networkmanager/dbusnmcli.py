@@ -0,0 +1,410 @@
+# coding=utf-8
+import socket
+import struct
+import time
+
+import dbus
+
+from capture import REDACTED
+from nmcli import Nmcli, NmcliError, CommandTarget
+
+NM_BUS_NAME = "org.freedesktop.NetworkManager"
+NM_PATH = "/org/freedesktop/NetworkManager"
+NM_SETTINGS_PATH = "/org/freedesktop/NetworkManager/Settings"
+
+NM_IFACE = "org.freedesktop.NetworkManager"
+NM_DEVICE_IFACE = "org.freedesktop.NetworkManager.Device"
+NM_WIRED_IFACE = "org.freedesktop.NetworkManager.Device.Wired"
+NM_WIRELESS_IFACE = "org.freedesktop.NetworkManager.Device.Wireless"
+NM_ACCESS_POINT_IFACE = "org.freedesktop.NetworkManager.AccessPoint"
+NM_ACTIVE_CONNECTION_IFACE = "org.freedesktop.NetworkManager.Connection.Active"
+NM_IP4_CONFIG_IFACE = "org.freedesktop.NetworkManager.IP4Config"
+NM_SETTINGS_IFACE = "org.freedesktop.NetworkManager.Settings"
+NM_CONNECTION_IFACE = "org.freedesktop.NetworkManager.Settings.Connection"
+PROPERTIES_IFACE = "org.freedesktop.DBus.Properties"
+
+# NMDeviceType values, named the way nmcli names them
+DEVICE_TYPES = {
+    1: "ethernet",
+    2: "wifi",
+    5: "bt",
+    6: "olpc-mesh",
+    7: "wimax",
+    8: "gsm",
+    9: "infiniband",
+    10: "bond",
+    11: "vlan",
+    12: "adsl",
+    13: "bridge",
+    14: "generic",
+    15: "team",
+    16: "tun",
+    17: "ip-tunnel",
+    32: "loopback"
+}
+
+# NMDeviceState values
+DEVICE_STATE_UNMANAGED = 10
+DEVICE_STATE_UNAVAILABLE = 20
+DEVICE_STATE_ACTIVATED = 100
+
+# NM80211ApFlags and NM80211ApSecurityFlags
+AP_FLAGS_PRIVACY = 0x1
+AP_SEC_KEY_MGMT_PSK = 0x100
+AP_SEC_KEY_MGMT_802_1X = 0x200
+AP_SEC_KEY_MGMT_SAE = 0x400
+
+
+class DbusNmcli(Nmcli):
+    """
+    Nmcli backend that answers the read-only queries (status, scan, configured connections and their details)
+    over one persistent D-Bus connection to NetworkManager instead of forking nmcli and dbus-send for every query.
+    Everything that changes the configuration is still handled by nmcli.
+
+    Pass bus_address to talk to a NetworkManager (mock) service on a private bus, for example one started
+    with dbus-daemon --session --print-address.
+    """
+
+    def __init__(self, bus_address = None, **kwargs):
+        super(DbusNmcli, self).__init__(**kwargs)
+
+        if bus_address:
+            self.bus = dbus.bus.BusConnection(bus_address)
+        else:
+            self.bus = dbus.SystemBus()
+
+    def scan_wifi(self, force=False):
+        """
+        Scans wifi acces points and returns list of cells
+        """
+
+        if force:
+            self.rescan_wifi()
+
+        try:
+            return self._filter_cells(self.iter_wifi_cells()) or None
+        except NmcliError as err:
+            self.logger.warn("Could not scan wifi over D-Bus: {0}".format(err))
+            return None
+
+    def _iter_wifi_cells(self):
+        connection_uuids = self._get_connection_uuid_index()
+
+        try:
+            for path, props in self._get_devices():
+                if props["DeviceType"] != 2:
+                    continue
+
+                for ap_path in self._get_access_points(path):
+                    ap = self._get_properties(ap_path, NM_ACCESS_POINT_IFACE)
+                    ssid = self._decode_ssid(ap["Ssid"])
+                    yield {
+                        "ssid": ssid,
+                        "bssid": str(ap["HwAddress"]),
+                        "signal": int(ap["Strength"]),
+                        "security": self._get_ap_security(ap),
+                        "connection_uuid": connection_uuids.get(ssid, None)
+                        }
+        except dbus.exceptions.DBusException as err:
+            raise NmcliError(1, str(err))
+
+    def _get_connection_uuid_index(self):
+        """
+        Returns a dict that maps SSIDs to the uuid of the first wifi connection with that SSID
+        """
+        index = {}
+
+        try:
+            for path, settings in self._get_connection_settings():
+                ssid = self._get_settings_ssid(settings)
+                if ssid:
+                    index.setdefault(ssid, str(settings["connection"]["uuid"]))
+        except dbus.exceptions.DBusException as err:
+            self.logger.warn("Could not read the connection SSIDs over D-Bus: {0}".format(err))
+
+        return index
+
+    def rescan_wifi(self):
+        """
+        Rescans the wifi APS
+        """
+        try:
+            for path, props in self._get_devices():
+                if props["DeviceType"] == 2:
+                    self._call(path, NM_WIRELESS_IFACE, "RequestScan", dbus.Dictionary({}, signature="sv"))
+        except dbus.exceptions.DBusException as err:
+            # NetworkManager refuses scans that follow each other too quickly
+            self.logger.warn("Could not request wifi scan over D-Bus: {0}".format(err))
+            return 1, str(err)
+
+        return 0, ""
+
+    def get_status(self):
+        """
+        Return status of connections. See Nmcli.get_status for the returned structure.
+        """
+
+        result = {}
+
+        try:
+            for path, props in self._get_devices():
+                device_type = DEVICE_TYPES.get(int(props["DeviceType"]), "unknown")
+                if device_type == "loopback":
+                    continue
+
+                state = int(props["State"])
+                device = str(props["Interface"])
+                connection_uuid = None
+                status = {}
+
+                if props["ActiveConnection"] != "/":
+                    active = self._get_properties(props["ActiveConnection"], NM_ACTIVE_CONNECTION_IFACE)
+                    connection_uuid = str(active["Uuid"])
+                    settings = self._call(active["Connection"], NM_CONNECTION_IFACE, "GetSettings")
+
+                    status["ssid"] = self._get_settings_ssid(settings)
+                    status["ip"] = self._get_active_ip(props["Ip4Config"])
+
+                status["connection_uuid"] = connection_uuid
+                status["connected"] = state == DEVICE_STATE_ACTIVATED
+                status["enabled"] = state != DEVICE_STATE_UNAVAILABLE and state != DEVICE_STATE_UNMANAGED
+                status["mac_address"] = self._get_device_mac_address(path, device, device_type, props)
+
+                # Systems with more devices of a type report the connected one, or else the first
+                if device_type not in result or (status["connected"] and not result[device_type]["connected"]):
+                    result[device_type] = status
+        except dbus.exceptions.DBusException as err:
+            self.logger.warn("Could not read status over D-Bus: {0}".format(err))
+
+        return result
+
+    def _read_configured_connections(self):
+        try:
+            return list(self.iter_configured_connections())
+        except NmcliError as err:
+            self.logger.warn("Could not read configured connections over D-Bus: {0}".format(err))
+            return None
+
+    def iter_configured_connections(self):
+        try:
+            for path, settings in self._get_connection_settings():
+                connection = settings["connection"]
+                yield {
+                    "name": connection["id"],
+                    "uuid": str(connection["uuid"]),
+                    "type": self._get_connection_type(str(connection["type"])),
+                    "autoconnect": bool(connection.get("autoconnect", True)),
+                    "dbus_path": str(path)
+                    }
+        except dbus.exceptions.DBusException as err:
+            raise NmcliError(1, str(err))
+
+    def get_configured_connection_details(self, uuid, read_psk = True):
+        try:
+            for path, settings in self._get_connection_settings():
+                connection = settings["connection"]
+
+                # Like nmcli con show, accept a connection id as well as an uuid
+                if uuid == connection["uuid"] or uuid == connection["id"]:
+                    return self._get_settings_details(path, settings, read_psk, self._get_active_ips())
+        except dbus.exceptions.DBusException as err:
+            self.logger.warn("Could not read connection {0} over D-Bus: {1}".format(uuid, err))
+
+    def get_configured_connection_details_many(self, uuids = None, read_psk = False):
+        try:
+            # The active connections are read once for all connections
+            active_ips = self._get_active_ips()
+            return [self._get_settings_details(path, settings, read_psk, active_ips)
+                    for path, settings in self._get_connection_settings()
+                    if uuids is None or settings["connection"]["uuid"] in uuids]
+        except dbus.exceptions.DBusException as err:
+            self.logger.warn("Could not read connection details over D-Bus: {0}".format(err))
+            return None
+
+    def _get_psk(self, connection_uuid):
+        if not connection_uuid:
+            return ""
+
+        try:
+            for path, settings in self._get_connection_settings():
+                if settings["connection"]["uuid"] == connection_uuid:
+                    return self._get_secret_psk(path)
+        except dbus.exceptions.DBusException as err:
+            self.logger.warn("Could not retrieve PSK for connection {0}: {1}".format(connection_uuid, err))
+
+        return ""
+
+    ##~~ D-Bus helpers
+
+    def _call(self, path, interface, method, *args):
+        """
+        Calls method of the object at path and tells the command observers about it, like about a command that
+        ran. Raises dbus.exceptions.DBusException when the call fails.
+        """
+        returncode = 0
+        result = None
+        started = time.time()
+
+        try:
+            result = getattr(self._get_object(path), method)(*args, dbus_interface=interface)
+            return result
+        except dbus.exceptions.DBusException as err:
+            returncode = 1
+            result = err
+            raise
+        finally:
+            if self.command_observers:
+                output = REDACTED if method == "GetSecrets" and returncode == 0 else str(result)
+                self._notify_command_observers(CommandTarget.DBUS, [path, interface + "." + method] + [str(arg) for arg in args],
+                                               returncode, output, time.time() - started)
+
+    def _get_object(self, path):
+        return self.bus.get_object(NM_BUS_NAME, path)
+
+    def _get_properties(self, path, interface):
+        return self._call(path, PROPERTIES_IFACE, "GetAll", interface)
+
+    def _get_devices(self):
+        """
+        Yields (path, properties) of all devices known to NetworkManager
+        """
+        for path in self._call(NM_PATH, NM_IFACE, "GetDevices"):
+            yield path, self._get_properties(path, NM_DEVICE_IFACE)
+
+    def _get_access_points(self, path):
+        try:
+            return self._call(path, NM_WIRELESS_IFACE, "GetAllAccessPoints")
+        except dbus.exceptions.DBusException:
+            # NetworkManager < 1.2 only knows about the visible access points
+            return self._call(path, NM_WIRELESS_IFACE, "GetAccessPoints")
+
+    def _get_connection_settings(self):
+        """
+        Yields (path, settings) of all configured connections
+        """
+        for path in self._call(NM_SETTINGS_PATH, NM_SETTINGS_IFACE, "ListConnections"):
+            yield path, self._call(path, NM_CONNECTION_IFACE, "GetSettings")
+
+    def _get_settings_details(self, path, settings, read_psk, active_ips):
+        """
+        Maps the settings of a connection to connection details, active_ips as returned by _get_active_ips
+        """
+        connection = settings["connection"]
+        isWireless = "wireless" in connection["type"]
+        ipv4 = settings.get("ipv4", {})
+        addresses = self._get_settings_addresses(ipv4)
+
+        psk = ""
+        if read_psk and isWireless:
+            psk = self._get_secret_psk(path)
+
+        return {
+            "uuid": str(connection["uuid"]),
+            "name": self._get_settings_ssid(settings) or "Wired",
+            "autoconnect": bool(connection.get("autoconnect", True)),
+            "isWireless": isWireless,
+            "ssid": self._get_settings_ssid(settings),
+            "psk": psk,
+            "ipv4": {
+                "method": str(ipv4["method"]) if "method" in ipv4 else None,
+                "ip": addresses[0][0] if addresses else None,
+                "active_ip": active_ips.get(str(connection["uuid"])),
+                "gateway": self._get_settings_gateway(ipv4, addresses),
+                "dns": [self._int_to_ipv4(dns) for dns in ipv4.get("dns", [])]
+                }
+            }
+
+    def _get_secret_psk(self, path):
+        try:
+            secrets = self._call(path, NM_CONNECTION_IFACE, "GetSecrets", "802-11-wireless-security")
+        except dbus.exceptions.DBusException as err:
+            self.logger.warn("Could not retrieve PSK for connection at dbus path {0}: {1}".format(path, err))
+            return ""
+
+        return str(secrets.get("802-11-wireless-security", {}).get("psk", ""))
+
+    def _get_device_mac_address(self, path, device, device_type, props):
+        if not self.mac_addresses.get(device, None):
+            if "HwAddress" in props:
+                mac_address = str(props["HwAddress"])
+            elif device_type == "wifi":
+                mac_address = str(self._get_properties(path, NM_WIRELESS_IFACE)["HwAddress"])
+            elif device_type == "ethernet":
+                mac_address = str(self._get_properties(path, NM_WIRED_IFACE)["HwAddress"])
+            else:
+                mac_address = None
+
+            self.mac_addresses[device] = mac_address
+
+        return self.mac_addresses[device]
+
+    def _get_active_ip(self, ip4_config_path):
+        if ip4_config_path == "/":
+            return None
+
+        config = self._get_properties(ip4_config_path, NM_IP4_CONFIG_IFACE)
+
+        if config.get("AddressData"):
+            return str(config["AddressData"][0]["address"])
+        if config.get("Addresses"):
+            return self._int_to_ipv4(config["Addresses"][0][0])
+
+    def _get_active_ips(self):
+        """
+        Returns a dict that maps the uuids of the active connections to their IP address
+        """
+        active_ips = {}
+
+        for path in self._call(NM_PATH, PROPERTIES_IFACE, "Get", NM_IFACE, "ActiveConnections"):
+            active = self._get_properties(path, NM_ACTIVE_CONNECTION_IFACE)
+            active_ips[str(active["Uuid"])] = self._get_active_ip(active["Ip4Config"])
+
+        return active_ips
+
+    def _get_settings_ssid(self, settings):
+        ssid = settings.get("802-11-wireless", {}).get("ssid", None)
+        return self._decode_ssid(ssid) if ssid else None
+
+    def _get_settings_addresses(self, ipv4):
+        """
+        Returns a list of (ip, gateway) tuples. Gateway is None when it is not set per address
+        """
+        if ipv4.get("address-data"):
+            return [(str(address["address"]), None) for address in ipv4["address-data"]]
+
+        return [(self._int_to_ipv4(address[0]), self._int_to_ipv4(address[2]) if address[2] else None) for address in ipv4.get("addresses", [])]
+
+    def _get_settings_gateway(self, ipv4, addresses):
+        if ipv4.get("gateway"):
+            return str(ipv4["gateway"])
+        if addresses:
+            return addresses[0][1]
+
+    def _get_ap_security(self, ap):
+        """
+        Describes the access point security the same way nmcli does, for example "WPA1 WPA2"
+        """
+        flags = int(ap["Flags"])
+        wpa_flags = int(ap["WpaFlags"])
+        rsn_flags = int(ap["RsnFlags"])
+
+        security = []
+        if flags & AP_FLAGS_PRIVACY and not wpa_flags and not rsn_flags:
+            security.append("WEP")
+        if wpa_flags:
+            security.append("WPA1")
+        if rsn_flags & AP_SEC_KEY_MGMT_SAE:
+            security.append("WPA3")
+        elif rsn_flags:
+            security.append("WPA2")
+        if (wpa_flags | rsn_flags) & AP_SEC_KEY_MGMT_802_1X:
+            security.append("802.1X")
+
+        return " ".join(security)
+
+    def _decode_ssid(self, ssid):
+        return bytearray(ssid).decode("utf-8", "replace")
+
+    def _int_to_ipv4(self, address):
+        # NetworkManager stores addresses as a uint32 in network byte order
+        return socket.inet_ntoa(struct.pack("=I", int(address)))
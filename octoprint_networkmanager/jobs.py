@@ -0,0 +1,357 @@
+# coding=utf-8
+import itertools
+import logging
+import threading
+import time
+
+from Queue import Queue
+
+
+class JobState(object):
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+
+
+class ScanJob(object):
+    def __init__(self, id):
+        self.id = id
+        self.state = JobState.RUNNING
+        self.started = time.time()
+        self.finished = None
+        self.wifis = None
+        self.error = None
+
+        self._done = threading.Event()
+
+    def wait(self, timeout = None):
+        self._done.wait(timeout)
+        return self._done.is_set()
+
+    def as_dict(self):
+        return dict(
+            id=self.id,
+            state=self.state,
+            started=self.started,
+            finished=self.finished,
+            wifis=self.wifis,
+            error=self.error
+        )
+
+
+class ScanJobs(object):
+    """
+    Runs wifi scans in the background. A scan that is requested while another one is running joins the running
+    one instead of starting a new rescan. scan is called on the worker thread and returns the wifi list,
+    on_done is called with the finished job. When an operation queue is given the scans run on it, so a rescan
+    never overlaps a queued change.
+    """
+
+    def __init__(self, scan, on_done = None, keep = 10, operations = None):
+        self.logger = logging.getLogger("octoprint.plugins.networkmanager.jobs")
+
+        self.scan = scan
+        self.on_done = on_done
+        self.keep = keep
+        self.operations = operations
+
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._jobs = {}
+        self._running = None
+
+    def start(self):
+        """
+        Starts a scan, or returns the one that is already running
+        """
+        with self._lock:
+            if self._running:
+                return self._running
+
+            job = ScanJob(str(next(self._ids)))
+            self._jobs[job.id] = job
+            self._running = job
+
+            # Forget the oldest jobs
+            for id in sorted(self._jobs, key=int)[:-self.keep]:
+                del self._jobs[id]
+
+        thread = threading.Thread(target=self._run, args=(job,), name="Wifi scan {0}".format(job.id))
+        thread.daemon = True
+        thread.start()
+
+        return job
+
+    def get(self, id):
+        with self._lock:
+            return self._jobs.get(id)
+
+    def _run(self, job):
+        if self.operations:
+            operation = self.operations.submit("Wifi scan", self.scan)
+            operation.wait()
+
+            job.wifis = operation.result
+            job.error = operation.error
+            job.state = JobState.FAILED if operation.state == OperationState.FAILED else JobState.DONE
+        else:
+            try:
+                job.wifis = self.scan()
+                job.state = JobState.DONE
+            except Exception as e:
+                self.logger.exception("Error while scanning wifi: {0}".format(e))
+                job.error = str(e)
+                job.state = JobState.FAILED
+
+        job.finished = time.time()
+
+        with self._lock:
+            self._running = None
+
+        job._done.set()
+
+        if self.on_done:
+            try:
+                self.on_done(job)
+            except Exception as e:
+                self.logger.exception("Error while handling finished wifi scan: {0}".format(e))
+
+
+class OperationState(object):
+    QUEUED = "queued"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+
+
+class Operation(object):
+    def __init__(self, id, name, function):
+        self.id = id
+        self.name = name
+        self.function = function
+        self.state = OperationState.QUEUED
+        self.queued = time.time()
+        self.started = None
+        self.finished = None
+        self.result = None
+        self.error = None
+
+        self._done = threading.Event()
+
+    def wait(self, timeout = None):
+        self._done.wait(timeout)
+        return self._done.is_set()
+
+    @property
+    def duration(self):
+        if self.started is None:
+            return None
+        return (self.finished or time.time()) - self.started
+
+    def as_dict(self):
+        return dict(
+            id=self.id,
+            name=self.name,
+            state=self.state,
+            queued=self.queued,
+            started=self.started,
+            finished=self.finished,
+            duration=self.duration,
+            result=self.result,
+            error=self.error
+        )
+
+
+class OperationQueue(object):
+    """
+    Runs all operations that change NetworkManager's configuration one after another on a single worker thread,
+    so they never interleave. An operation fails when its function raises or returns False. on_change is called
+    with the operation whenever its state changes.
+    """
+
+    def __init__(self, on_change = None, keep = 50):
+        self.logger = logging.getLogger("octoprint.plugins.networkmanager.jobs")
+
+        self.on_change = on_change
+        self.keep = keep
+
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._operations = {}
+        self._queue = Queue()
+
+        self._thread = threading.Thread(target=self._work, name="NetworkManager operations")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def submit(self, name, function):
+        with self._lock:
+            operation = Operation(str(next(self._ids)), name, function)
+            self._operations[operation.id] = operation
+
+            # Forget the oldest operations
+            for id in sorted(self._operations, key=int)[:-self.keep]:
+                del self._operations[id]
+
+        self._queue.put(operation)
+        self._changed(operation)
+
+        return operation
+
+    def get(self, id):
+        with self._lock:
+            return self._operations.get(id)
+
+    def _work(self):
+        while True:
+            operation = self._queue.get()
+
+            operation.started = time.time()
+            operation.state = OperationState.RUNNING
+            self._changed(operation)
+
+            try:
+                operation.result = operation.function()
+                operation.state = OperationState.FAILED if operation.result is False else OperationState.SUCCEEDED
+            except Exception as e:
+                self.logger.exception("Error while running {0}: {1}".format(operation.name, e))
+                operation.error = str(e)
+                operation.state = OperationState.FAILED
+
+            operation.finished = time.time()
+            self.logger.info("{0} {1} after {2:.2f} seconds".format(operation.name, operation.state, operation.duration))
+            operation._done.set()
+            self._changed(operation)
+
+    def _changed(self, operation):
+        if self.on_change:
+            try:
+                self.on_change(operation)
+            except Exception as e:
+                self.logger.exception("Error while handling operation state: {0}".format(e))
+
+
+class ResetState(object):
+    IDLE = "idle"
+    OFF = "off"
+    WAITING = "waiting"
+    ON = "on"
+    RESCANNING = "rescanning"
+    DONE = "done"
+    FAILED = "failed"
+
+    ACTIVE = [OFF, WAITING, ON, RESCANNING]
+
+
+class WifiReset(object):
+    """
+    Resets the wifi radio in the background: off -> waiting -> on -> rescanning -> done. Every step is scheduled
+    with a timer, so no request has to wait for the radio. When an operation queue is given the steps run on it,
+    in line with the other changes. on_change is called with the status after every step.
+    """
+
+    def __init__(self, nmcli, on_change = None, delay = 5, operations = None):
+        self.logger = logging.getLogger("octoprint.plugins.networkmanager.jobs")
+
+        self.nmcli = nmcli
+        self.on_change = on_change
+        self.delay = delay
+        self.operations = operations
+
+        self._lock = threading.Lock()
+        self.state = ResetState.IDLE
+        self.started = None
+        self.finished = None
+        self.error = None
+
+    @property
+    def running(self):
+        return self.state in ResetState.ACTIVE
+
+    def start(self):
+        """
+        Starts a reset. Returns False and does nothing when a reset is running already
+        """
+        with self._lock:
+            if self.running:
+                return False
+
+            self.started = time.time()
+            self.finished = None
+            self.error = None
+            self._set_state(ResetState.OFF)
+
+        self._schedule(0, self._turn_off)
+        return True
+
+    def as_dict(self):
+        return dict(
+            state=self.state,
+            started=self.started,
+            finished=self.finished,
+            error=self.error
+        )
+
+    def _turn_off(self):
+        if not self.nmcli.set_wifi_radio(False):
+            return self._fail("Could not turn off the wifi radio")
+
+        self._set_state(ResetState.WAITING)
+        self._schedule(self.delay, self._turn_on)
+
+    def _turn_on(self):
+        self._set_state(ResetState.ON)
+
+        if not self.nmcli.set_wifi_radio(True):
+            return self._fail("Could not turn on the wifi radio")
+
+        self.nmcli.invalidate_configured_connections()
+        self.logger.info("Wifi reset")
+
+        self._set_state(ResetState.RESCANNING)
+        self._schedule(0, self._rescan)
+
+    def _rescan(self):
+        self.nmcli.rescan_wifi()
+
+        self.finished = time.time()
+        self._set_state(ResetState.DONE)
+
+    def _fail(self, error):
+        self.logger.error(error)
+
+        self.error = error
+        self.finished = time.time()
+        self._set_state(ResetState.FAILED)
+
+    def _schedule(self, delay, step):
+        timer = threading.Timer(delay, self._queue_step, args=(step,))
+        timer.daemon = True
+        timer.start()
+
+    def _queue_step(self, step):
+        if self.operations:
+            self.operations.submit("Wifi reset ({0})".format(self.state), lambda: self._run_step(step))
+        else:
+            self._run_step(step)
+
+    def _run_step(self, step):
+        """
+        Runs a step, returns False when the reset failed so the operation that ran it fails as well
+        """
+        try:
+            step()
+        except Exception as e:
+            self.logger.exception("Error while resetting wifi: {0}".format(e))
+            self._fail(str(e))
+
+        return self.state != ResetState.FAILED
+
+    def _set_state(self, state):
+        self.state = state
+
+        if self.on_change:
+            try:
+                self.on_change(self.as_dict())
+            except Exception as e:
+                self.logger.exception("Error while handling wifi reset state: {0}".format(e))
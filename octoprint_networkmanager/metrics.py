@@ -0,0 +1,155 @@
+# coding=utf-8
+import threading
+
+from nmcli import CommandTarget, ReturnCode
+
+# Upper bounds of the latency histogram buckets in seconds, +Inf is implied
+LATENCY_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 90]
+
+# nmcli accepts abbreviations and synonyms, count them as one kind
+WORD_ALIASES = {
+    "c": "con",
+    "connection": "con",
+    "d": "dev",
+    "device": "dev",
+    "mod": "modify",
+    "m": "modify",
+    "r": "radio"
+}
+
+# Options that are followed by a value
+VALUE_OPTIONS = ["-f", "--fields", "-m", "--mode", "-w", "--wait"]
+
+
+def command_kind(target, command):
+    """
+    Returns the kind of a command without its arguments, like "dev wifi list", "con show" or "dbus GetSecrets"
+    """
+    if target != CommandTarget.NMCLI:
+        for argument in command:
+            if argument.startswith("org.freedesktop.") and "." in argument:
+                return "dbus " + argument.rsplit(".", 1)[1]
+        return "dbus"
+
+    words = []
+    skip = False
+    for argument in command:
+        if skip:
+            skip = False
+        elif argument in VALUE_OPTIONS:
+            skip = True
+        elif argument == "--version":
+            return "version"
+        elif not argument.startswith("-"):
+            words.append(WORD_ALIASES.get(argument, argument))
+
+    # dev wifi list, dev wifi connect ... have three words, the others two
+    length = 3 if words[:2] == ["dev", "wifi"] else 2
+    return " ".join(words[:length]) or "nmcli"
+
+
+class Histogram(object):
+    def __init__(self, buckets = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+
+
+class Metrics(object):
+    """
+    Counts and times the nmcli commands and blueprint requests, and renders them in the Prometheus text format.
+    observe_command can be used as a command observer of Nmcli.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._commands = {}
+        self._timeouts = {}
+        self._command_latency = {}
+        self._requests = {}
+        self._request_latency = {}
+
+    def observe_command(self, target, command, returncode, output, latency):
+        kind = command_kind(target, command)
+
+        with self._lock:
+            key = (kind, str(returncode))
+            self._commands[key] = self._commands.get(key, 0) + 1
+
+            if returncode == ReturnCode.TIMEOUT:
+                self._timeouts[kind] = self._timeouts.get(kind, 0) + 1
+
+            self._command_latency.setdefault(kind, Histogram()).observe(latency)
+
+    def observe_request(self, route, method, status, latency):
+        with self._lock:
+            key = (route, method, str(status))
+            self._requests[key] = self._requests.get(key, 0) + 1
+
+            self._request_latency.setdefault((route, method), Histogram()).observe(latency)
+
+    def render(self, values = None):
+        """
+        Returns all metrics in the Prometheus text format. values is a list of (name, type, help, value) of metrics
+        that are kept elsewhere, they are added as they are.
+        """
+        lines = []
+
+        with self._lock:
+            self._render_counter(lines, "networkmanager_nmcli_commands_total",
+                                 "nmcli and dbus-send commands that ran, by kind and exit code",
+                                 ["kind", "exit_code"], self._commands)
+            self._render_counter(lines, "networkmanager_nmcli_timeouts_total",
+                                 "Commands that were killed after the timeout, by kind",
+                                 ["kind"], dict(((kind,), count) for kind, count in self._timeouts.items()))
+            self._render_histogram(lines, "networkmanager_nmcli_command_duration_seconds",
+                                   "Time the commands took, by kind",
+                                   ["kind"], dict(((kind,), histogram) for kind, histogram in self._command_latency.items()))
+            self._render_counter(lines, "networkmanager_http_requests_total",
+                                 "Blueprint requests, by route, method and status",
+                                 ["route", "method", "status"], self._requests)
+            self._render_histogram(lines, "networkmanager_http_request_duration_seconds",
+                                   "Time the blueprint took to answer, by route and method",
+                                   ["route", "method"], self._request_latency)
+
+        for name, type, help, value in values or []:
+            lines.append("# HELP {0} {1}".format(name, help))
+            lines.append("# TYPE {0} {1}".format(name, type))
+            lines.append("{0} {1}".format(name, value))
+
+        return "\n".join(lines) + "\n"
+
+    def _render_counter(self, lines, name, help, labels, values):
+        lines.append("# HELP {0} {1}".format(name, help))
+        lines.append("# TYPE {0} counter".format(name))
+
+        for key in sorted(values):
+            lines.append("{0}{1} {2}".format(name, self._format_labels(labels, key), values[key]))
+
+    def _render_histogram(self, lines, name, help, labels, histograms):
+        lines.append("# HELP {0} {1}".format(name, help))
+        lines.append("# TYPE {0} histogram".format(name))
+
+        for key in sorted(histograms):
+            histogram = histograms[key]
+
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                lines.append("{0}_bucket{1} {2}".format(name, self._format_labels(labels + ["le"], key + (str(bound),)), count))
+            lines.append("{0}_bucket{1} {2}".format(name, self._format_labels(labels + ["le"], key + ("+Inf",)), histogram.count))
+            lines.append("{0}_sum{1} {2}".format(name, self._format_labels(labels, key), histogram.sum))
+            lines.append("{0}_count{1} {2}".format(name, self._format_labels(labels, key), histogram.count))
+
+    def _format_labels(self, labels, values):
+        pairs = []
+        for label, value in zip(labels, values):
+            value = value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+            pairs.append("{0}=\"{1}\"".format(label, value))
+        return "{" + ",".join(pairs) + "}"
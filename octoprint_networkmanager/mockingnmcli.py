@@ -1,11 +1,9 @@
-from nmcli import Nmcli, CommandTarget
-from random import randint
+import random
+import threading
+import time
 
-def is_equal_command(command, compare):
-    for i in range(len(compare)):
-        if not compare[i] in command:
-            return False
-    return True
+from nmcli import Nmcli, NmcliError, CommandTarget
+from Queue import Queue
 
 def get_fields_from_command(command):
     last = None
@@ -20,135 +18,206 @@ def get_fields_from_command(command):
     if fields:
         return ":".join([ "{" + field + "}" for field in fields])
 
-def get_random_mac():
-    return ":".join(["{0:02x}".format(randint(0,255)).upper() for i in range(6)])
+def escape_terse(value):
+    return value.replace("\\", "\\\\").replace(":", "\\:")
 
-def get_random_connection_uuid():
-    p1 = "".join(["{0:02x}".format(randint(0,255)) for i in range(4)])
-    p2 = "".join(["{0:02x}".format(randint(0,255)) for i in range(2)])
-    p3 = "".join(["{0:02x}".format(randint(0,255)) for i in range(2)])
-    p4 = "".join(["{0:02x}".format(randint(0,255)) for i in range(2)])
-    p5 = "".join(["{0:02x}".format(randint(0,255)) for i in range(4)])
+def get_random_mac(rng = random):
+    return ":".join(["{0:02x}".format(rng.randint(0,255)).upper() for i in range(6)])
 
-    return "-".join([p1, p2, p3, p4, p5])
+def get_random_connection_uuid(rng = random):
+    return "-".join(["".join(["{0:02x}".format(rng.randint(0,255)) for i in range(length)]) for length in [4, 2, 2, 2, 4]])
 
 class MockingNmcli(Nmcli):
-    def  __init__(self):
-        super(MockingNmcli, self).__init__()
-        self.devices = [ DeviceMock("eth0", "ethernet", True, get_random_mac()), DeviceMock("wlan0", "wifi", True,  get_random_mac()) ] 
-        self.wifis = [ WifiMock("Leapfrog " + str(x), randint(0,100), MockingNmcli.SECURITIES[randint(0,3)]) for x in range(20) ]
-        self.connections = [ ConnectionMock("eth0", get_random_connection_uuid(), "802-3-ethernet", "yes", "0"),
-                             ConnectionMock(self.wifis[0].ssid, get_random_connection_uuid(), "802-11-wireless", "no", "0", ssid=self.wifis[0].ssid, psk="Psk1")
+    """
+    Answers nmcli commands from an in-memory model of NetworkManager, so the plugin can run without hardware.
+
+    The model is built from seed, so the same options give the same devices, access points and profiles.
+    devices is the number of network devices (alternating ethernet and wifi, at least one of each),
+    access_points the number of access points and profiles the number of configured connections.
+    latency and failure_rate are either a number for all commands or a dict by command kind (see NMCLI_COMMANDS),
+    every command then takes latency seconds and fails with probability failure_rate.
+    """
+
+    def  __init__(self, seed = None, devices = 2, access_points = 20, profiles = 2, latency = 0, failure_rate = 0, **kwargs):
+        self.random = random.Random(seed)
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.monitors = []
+        self._lock = threading.Lock()
+
+        self.devices = []
+        for i in range(max(devices, 2)):
+            if i % 2 == 0:
+                self.devices.append(DeviceMock("eth{0}".format(i // 2), "ethernet", True, get_random_mac(self.random)))
+            else:
+                self.devices.append(DeviceMock("wlan{0}".format(i // 2), "wifi", True, get_random_mac(self.random)))
+
+        self.wifis = [ WifiMock("Leapfrog " + str(x), get_random_mac(self.random), self.random.randint(0,100), self.random.choice(MockingNmcli.SECURITIES)) for x in range(max(access_points, 1)) ]
+
+        self.connections = [ ConnectionMock("eth0", get_random_connection_uuid(self.random), "802-3-ethernet", "yes", "0"),
+                             ConnectionMock(self.wifis[0].ssid, get_random_connection_uuid(self.random), "802-11-wireless", "no", "1", ssid=self.wifis[0].ssid, psk="Psk1")
                             ]
+        for x in range(2, profiles):
+            ssid = self.wifis[x % len(self.wifis)].ssid
+            self.connections.append(ConnectionMock("Profile " + str(x), get_random_connection_uuid(self.random), "802-11-wireless", "no", str(x), ssid=ssid, psk="Psk" + str(x)))
+
         self._auto_connect()
 
+        # Checks the (mocked) nmcli version, so the model has to exist first
+        super(MockingNmcli, self).__init__(**kwargs)
+
+
+    def _get_devices_for(self, connection):
+        device_type = "ethernet" if "ethernet" in connection.type else "wifi"
+        return [dev for dev in self.devices if dev.type == device_type]
 
     def _auto_connect(self, device = None):
-        # Simulate autoconnect
+        # Simulate autoconnect, every profile comes up on the first free device of its type
         for connection in self.connections:
-            if connection.autoconnect == "yes" and "ethernet" in connection.type and (not device or device == self.devices[0].device):
-                self.devices[0].conn_uuid = connection.uuid
-                connection.device = self.devices[0].device
-            elif connection.autoconnect == "yes" and "wireless" in connection.type and (not device or device == self.devices[1].device):
-                self.devices[1].conn_uuid = connection.uuid
-                connection.device = self.devices[1].device
-
-    def _send_command(self, command, target = CommandTarget.NMCLI):
+            if connection.autoconnect != "yes" or connection.device:
+                continue
+
+            for dev in self._get_devices_for(connection):
+                if dev.enabled and not dev.conn_uuid and (not device or device == dev.device):
+                    dev.conn_uuid = connection.uuid
+                    connection.device = dev.device
+                    break
+
+    def _run_command(self, command, target, timeout):
         """
-        Sends command to ncmli with subprocess.
+        Answers the command with mocked output instead of running it, after the configured latency.
         Returns (0, output) of the command if succeeded, returns the exit code and output when errors
         """
+        kind, handler = self._find_command(command, target)
+
+        latency = self._get_option(self.latency, kind)
+        if latency:
+            time.sleep(latency)
 
-        self._log_command(command)
+        if kind != "version" and self.random.random() < self._get_option(self.failure_rate, kind):
+            return 1, "Error: Injected failure of {0}".format(kind)
 
-        output = self._mock_command_output(command,  target)
+        with self._lock:
+            output = handler(command) if handler else None
+        self._notify_monitors(command)
 
         if isinstance(output, tuple):
-            self._log_command_output(*output)
             return output
         else:
-            self._log_command_output(0, output)
             return 0, output
 
-    def _mock_command_output(self, command, target):
-        if target == CommandTarget.DBUS:
-
-            if "org.freedesktop.NetworkManager.Settings.Connection.GetSecrets" in command:
-                return MockingNmcli.GET_SECRETS
-
-        elif target == CommandTarget.NMCLI:
-
-            # TODO: Strip this list to the bare essentials to identify the command, in stead of this copy/paste work
-            if is_equal_command(command, ["--version"]):
-                return MockingNmcli.NMCLI_VERSION
-            elif is_equal_command(command, ["-t", "-f", "name, uuid, type, autoconnect, dbus-path", "con", "show" ]):
-                return self._dev_con_list(command)
-            elif is_equal_command(command, ["-t", "-f", "NAME, DEVICE, TYPE", "c", "show", "--active"]):
-                return self._dev_con_list(command)
-            elif is_equal_command(command, ["con", "delete", "uuid"]):
-                return MockingNmcli.CON_DELETE
-            elif is_equal_command(command, ["-t", "con", "show"]):
-                return self._con_show_details(command)
-            elif is_equal_command(command, ["-t", "con", "modify"]):
-                return self._con_mod(command)
-            elif is_equal_command(command, [ "con", "up" ]):
-                return self._con_up(command)
-            elif is_equal_command(command,  ["radio", "wifi"]):
-                return self._radio_wifi(command)
-            elif is_equal_command(command, ["-t", "-f", "type", "dev"]):
-                return MockingNmcli.DEV_TYPE
-            elif is_equal_command(command, ["-t", "-f", "device, state", "device", "status"]):
-                return self._dev_status()
-            if is_equal_command(command, ["-t", "-f", "ssid, signal, security", "dev", "wifi", "list"]):
-                return self._dev_wifi_list()
-            elif is_equal_command(command, ["dev", "wifi", "rescan"]):
-                return MockingNmcli.DEV_WIFI_RESCAN
-            elif is_equal_command(command, ["dev", "wifi", "connect"]):
-                return MockingNmcli.DEV_WIFI_CONNECT
-            elif is_equal_command(command, ["dev", "connect" ]):
-                return MockingNmcli.DEV_CONNECT
-            elif is_equal_command(command, ["dev", "disconnect" ]):
-                return self._dev_disconnect(command)
-            elif is_equal_command(command, ["-t", "-f", "type, device, con-uuid, state", "dev"]):
-                return self._dev_state()
-            elif is_equal_command(command, ['-t', '-f', 'GENERAL.HWADDR', 'dev', 'show']):
-                return self._dev_hwaddr(command)
-            elif is_equal_command(command, ["-t", "-f", "IP4.ADDRESS", "d", "show"]):
-                return MockingNmcli.DEV_SHOW_IP
+    def _get_option(self, option, kind):
+        if isinstance(option, dict):
+            return option.get(kind, 0)
+        return option or 0
 
-    def _radio_wifi(self, command):
+    def _run_command_lines(self, command, target, timeout):
+        """
+        Streams the mocked output line by line
+        """
+        returncode, output = self._run_command(command, target, timeout)
 
-        if command[-1] == "on":
-            self.devices[1].enabled = True
-            self._auto_connect(self.devices[1].device)
-        else:
-            self.devices[1].enabled = False
-            conn = self._get_connection(self.devices[1].conn_uuid)
-            if conn:
-                conn.device = None
-            self.devices[1].conn_uuid = None
+        if returncode != 0:
+            raise NmcliError(returncode, output)
 
-    def _dev_wifi_list(self):
-        result = ""
+        for line in (output or "").splitlines():
+            yield line
 
-        for wifi in self.wifis:
-            result += "{ssid}:{signal}:{security}\n".format(**wifi.__dict__)
+    def start_monitor(self):
+        monitor = MonitorProcessMock()
+        self.monitors.append(monitor)
+        return monitor
 
-        return result
+    def _notify_monitors(self, command):
+        # Mimic the notifications nmcli monitor prints after changes
+        for verb in ["delete", "modify", "up", "radio", "connect", "disconnect"]:
+            if verb in command:
+                for monitor in self.monitors:
+                    monitor.notify("{0}: changed".format(verb))
+                break
 
-    def _dev_con_list(self, command):
-        result = ""
+    # Commands are recognized by the words they contain, the first entry whose words are all in the command wins
+    NMCLI_COMMANDS = [
+        ("version", ["--version"], "_version"),
+        ("connections", ["-t", "-f", "name, uuid, type, autoconnect, dbus-path", "con", "show" ], "_dev_con_list"),
+        ("active_connections", ["-t", "-f", "NAME, DEVICE, TYPE", "c", "show", "--active"], "_dev_con_list"),
+        ("con_delete", ["con", "delete", "uuid"], "_con_delete"),
+        ("con_show", ["-t", "con", "show"], "_con_show_details"),
+        ("con_modify", ["-t", "con", "modify"], "_con_mod"),
+        ("con_up", [ "con", "up" ], "_con_up"),
+        ("radio", ["radio", "wifi"], "_radio_wifi"),
+        ("dev_type", ["-t", "-f", "type", "dev"], "_dev_type"),
+        ("dev_status", ["-t", "-f", "device, state", "device", "status"], "_dev_status"),
+        ("wifi_list", ["-t", "-f", "ssid, bssid, signal, security", "dev", "wifi", "list"], "_dev_wifi_list"),
+        ("wifi_rescan", ["dev", "wifi", "rescan"], "_dev_wifi_rescan"),
+        ("wifi_connect", ["dev", "wifi", "connect"], "_dev_wifi_connect"),
+        ("dev_connect", ["dev", "connect" ], "_dev_connect"),
+        ("dev_disconnect", ["dev", "disconnect" ], "_dev_disconnect"),
+        ("dev_state", ["-t", "-f", "type, device, con-uuid, state", "dev"], "_dev_state"),
+        ("dev_show", ["-t", "-f", "GENERAL,IP4,CONNECTIONS", "dev", "show"], "_dev_show"),
+        ("dev_hwaddr", ['-t', '-f', 'GENERAL.HWADDR', 'dev', 'show'], "_dev_hwaddr"),
+        ("dev_ip", ["-t", "-f", "IP4.ADDRESS", "d", "show"], "_dev_show_ip"),
+    ]
+
+    DBUS_COMMANDS = [
+        ("get_secrets", ["org.freedesktop.NetworkManager.Settings.Connection.GetSecrets"], "_get_secrets"),
+    ]
+
+    def _find_command(self, command, target):
+        """
+        Returns the kind of the command and the method that answers it, or None for both for unknown commands
+        """
+        words = set(command)
+        table = MockingNmcli.DBUS_COMMANDS if target == CommandTarget.DBUS else MockingNmcli.NMCLI_COMMANDS
 
-        fields = get_fields_from_command(command)
-        only_active = "--active" in command
+        for kind, required, handler in table:
+            if words.issuperset(required):
+                return kind, getattr(self, handler)
+
+        return None, None
+
+    def _version(self, command):
+        return MockingNmcli.NMCLI_VERSION
+
+    def _get_secrets(self, command):
+        return MockingNmcli.GET_SECRETS
 
+    def _dev_wifi_rescan(self, command):
+        return MockingNmcli.DEV_WIFI_RESCAN
 
-        for conn in self.connections:
-            #result += "{name}:{uuid}:{type}:{autoconnect}:{dbus_path}\n".format(**conn.__dict__)
-            if not only_active or conn.device:
-                result += fields.format(**conn.__dict__) + "\n"
+    def _dev_connect(self, command):
+        return MockingNmcli.DEV_CONNECT
 
-        return result
+    def _dev_show_ip(self, command):
+        return MockingNmcli.DEV_SHOW_IP
+
+    def _dev_type(self, command):
+        return "\n".join([dev.type for dev in self.devices])
+
+    def _radio_wifi(self, command):
+        for dev in self.devices:
+            if dev.type != "wifi":
+                continue
+
+            if command[-1] == "on":
+                dev.enabled = True
+                self._auto_connect(dev.device)
+            else:
+                dev.enabled = False
+                conn = self._get_connection(dev.conn_uuid)
+                if conn:
+                    conn.device = None
+                dev.conn_uuid = None
+
+    def _dev_wifi_list(self, command):
+        return "".join(["{ssid}:{bssid}:{signal}:{security}\n".format(bssid=escape_terse(wifi.bssid), ssid=escape_terse(wifi.ssid), signal=wifi.signal, security=wifi.security)
+                        for wifi in self.wifis])
+
+    def _dev_con_list(self, command):
+        fields = get_fields_from_command(command)
+        only_active = "--active" in command
+
+        return "".join([fields.format(**conn.__dict__) + "\n" for conn in self.connections if not only_active or conn.device])
 
     def _dev_hwaddr(self, command):
         device = command[-1]
@@ -157,12 +226,44 @@ class MockingNmcli(Nmcli):
             if dev.device == device:
                 return "GENERAL.HWADDR:{hwaddr}\n".format(**dev.__dict__)
 
+    def _dev_show(self, command):
+        records = []
+
+        for dev in self.devices:
+            conn = self._get_connection(dev.conn_uuid)
+
+            lines = [
+                "GENERAL.DEVICE:{0}".format(dev.device),
+                "GENERAL.TYPE:{0}".format(dev.type),
+                "GENERAL.HWADDR:{0}".format(dev.hwaddr.replace(":", "\\:")),
+                "GENERAL.MTU:1500",
+                "GENERAL.STATE:{0} ({1})".format(DeviceMock.STATE_CODES[dev.state], dev.state),
+                "GENERAL.CONNECTION:{0}".format(conn.name if conn else "--"),
+                "GENERAL.CON-UUID:{0}".format(conn.uuid if conn else "--"),
+                "GENERAL.CON-PATH:{0}".format(conn.dbus_path if conn else "--")
+            ]
+
+            if conn:
+                lines.append("IP4.ADDRESS[1]:{0}".format(conn.ipv4addresses_active))
+
+            records.append("\n".join(lines))
+
+        return "\n\n".join(records) + "\n"
+
     def _con_show_details(self, command):
-        conn = self._get_connection(command[-1])
+        blocks = []
 
-        if not conn:
-            return 10, "Error: {0} - no such connection profile".format(command[-1])
+        for id in command[command.index("show") + 1:]:
+            conn = self._get_connection(id)
 
+            if not conn:
+                return 10, "Error: {0} - no such connection profile".format(id)
+
+            blocks.append(self._con_show_block(conn))
+
+        return "\n\n".join(blocks)
+
+    def _con_show_block(self, conn):
         return """connection.name:{name}
 connection.uuid:{uuid}
 connection.autoconnect:{autoconnect}
@@ -181,6 +282,19 @@ IP4.ADDRESS[1]:{ipv4addresses_active}""".format(ipv4addresses=conn.ipv4addresses
             if connection.uuid == uuid:
                 return connection
 
+    def _con_delete(self, command):
+        conn = self._get_connection(command[-1])
+
+        if not conn:
+            return (10, "Error: Connection not found")
+
+        for dev in self.devices:
+            if dev.conn_uuid == conn.uuid:
+                dev.conn_uuid = None
+        self.connections.remove(conn)
+
+        return MockingNmcli.CON_DELETE
+
     def _con_mod(self, command):
         conn = None
         last = None
@@ -209,17 +323,32 @@ IP4.ADDRESS[1]:{ipv4addresses_active}""".format(ipv4addresses=conn.ipv4addresses
         uuid = command[-1]
         target_conn = self._get_connection(uuid)
 
-        for conn in self.connections:
-            if target_conn.device == conn.device:
-                conn.device = ""
-        
-        if "ethernet" in target_conn.type:
-            target_conn.device = self.devices[0].device
-            self.devices[0].conn_uuid = target_conn.uuid
-        else:
-            target_conn.device = self.devices[1].device
-            self.devices[1].conn_uuid = target_conn.uuid
+        # The device the profile is active on, else the first free device of its type, else the first one
+        devices = self._get_devices_for(target_conn)
+        target_dev = next((dev for dev in devices if dev.device == target_conn.device), None) \
+            or next((dev for dev in devices if not dev.conn_uuid), None) \
+            or devices[0]
+
+        previous = self._get_connection(target_dev.conn_uuid)
+        if previous:
+            previous.device = ""
+
+        target_conn.device = target_dev.device
+        target_dev.conn_uuid = target_conn.uuid
+
 
+    def _dev_wifi_connect(self, command):
+        ssid = command[command.index("connect") + 1]
+        psk = command[command.index("password") + 1] if "password" in command else ""
+
+        if not any(wifi.ssid == ssid for wifi in self.wifis):
+            return (10, "Error: No network with SSID '{0}' found.".format(ssid))
+
+        conn = ConnectionMock(ssid, get_random_connection_uuid(self.random), "802-11-wireless", "yes", str(len(self.connections)), ssid=ssid, psk=psk)
+        self.connections.append(conn)
+        self._con_up(["con", "up", conn.uuid])
+
+        return MockingNmcli.DEV_WIFI_CONNECT.format(uuid=conn.uuid, device=conn.device)
 
     def _dev_disconnect(self, command):
         for dev in self.devices:
@@ -229,24 +358,14 @@ IP4.ADDRESS[1]:{ipv4addresses_active}""".format(ipv4addresses=conn.ipv4addresses
                 if conn:
                     conn.device = ""
 
-                dev.conn_uuid = ""
+                dev.conn_uuid = None
                 break
 
-    def _dev_status(self):
-        result = ""
-
-        for dev in self.devices:
-            result += "{device}:{state}\n".format(**dev.__dict__)
-
-        return result
-
-    def _dev_state(self):
-        result = ""
+    def _dev_status(self, command):
+        return "".join(["{0}:{1}\n".format(dev.device, dev.state) for dev in self.devices])
 
-        for dev in self.devices:
-            result += "{type}:{device}:{conn_uuid}:{state}\n".format(state=dev.state,**dev.__dict__)
-
-        return result
+    def _dev_state(self, command):
+        return "".join(["{type}:{device}:{conn_uuid}:{state}\n".format(state=dev.state,**dev.__dict__) for dev in self.devices])
 
     SECURITIES = [ "WPA2", "WPA", "WEP", "" ]
 
@@ -269,7 +388,7 @@ IP4.ADDRESS[1]:{ipv4addresses_active}""".format(ipv4addresses=conn.ipv4addresses
 
     DEV_CONNECT = """ """
 
-    DEV_TYPE = "ethernet\nwifi"
+    DEV_WIFI_CONNECT = "Device '{device}' successfully activated with '{uuid}'.\nConnection with UUID '{uuid}' created and activated on device '{device}'."
 
     DEV_STATUS = """ """
 
@@ -297,6 +416,32 @@ IP4.ADDRESS[1]:{ipv4addresses_active}""".format(ipv4addresses=conn.ipv4addresses
       )
    ]"""
 
+class MonitorProcessMock(object):
+    """
+    Stands in for the nmcli monitor process, lines are fed by the mocked commands
+    """
+    def __init__(self):
+        self.stdout = self
+        self.returncode = None
+        self._lines = Queue()
+
+    def notify(self, line):
+        if self.returncode is None:
+            self._lines.put(line + "\n")
+
+    def readline(self):
+        return self._lines.get()
+
+    def poll(self):
+        return self.returncode
+
+    def wait(self):
+        return self.returncode
+
+    def terminate(self):
+        self.returncode = -15
+        self._lines.put("")
+
 class DeviceMock(object):
     def __init__(self, device, type, enabled, hwaddr):
         self.device = device
@@ -305,7 +450,9 @@ class DeviceMock(object):
         self.hwaddr = hwaddr
 
         self.conn_uuid = None
-        
+
+    STATE_CODES = { "connected": 100, "available": 30, "unavailable": 20 }
+
     @property
     def state(self):
         if self.conn_uuid != None:
@@ -356,7 +503,8 @@ class ConnectionMock(object):
         return "{dns1}, {dns2}".format(dns1=self._ipv4dns1, dns2=self._ipv4dns2)
 
 class WifiMock(object):
-    def __init__(self, ssid, signal, security):
+    def __init__(self, ssid, bssid, signal, security):
         self.ssid = ssid
+        self.bssid = bssid
         self.signal = signal
         self.security = security
@@ -0,0 +1,102 @@
+# coding=utf-8
+import logging
+import threading
+import time
+
+
+class NetworkMonitor(object):
+    """
+    Supervises a nmcli monitor child and calls on_change once a burst of NetworkManager change notifications
+    has settled. The child is restarted with an increasing back-off when it exits.
+    """
+
+    def __init__(self, nmcli, on_change, debounce=0.5, max_backoff=60):
+        self.logger = logging.getLogger("octoprint.plugins.networkmanager.monitor")
+
+        self.nmcli = nmcli
+        self.on_change = on_change
+        self.debounce = debounce
+        self.max_backoff = max_backoff
+
+        self._lock = threading.Lock()
+        self._running = False
+        self._process = None
+        self._thread = None
+        self._timer = None
+
+    @property
+    def alive(self):
+        process = self._process
+        return self._running and process is not None and process.poll() is None
+
+    def start(self):
+        if self._running:
+            return
+
+        self._running = True
+        self._thread = threading.Thread(target=self._supervise, name="NetworkManager monitor")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+
+        with self._lock:
+            if self._timer:
+                self._timer.cancel()
+                self._timer = None
+
+        process = self._process
+        if process is not None and process.poll() is None:
+            process.terminate()
+
+    def _supervise(self):
+        backoff = 1
+
+        while self._running:
+            started = time.time()
+
+            try:
+                self._process = self.nmcli.start_monitor()
+                self.logger.info("Watching NetworkManager for changes")
+
+                # Anything may have changed while nobody was watching
+                self._schedule_change()
+
+                for line in iter(self._process.stdout.readline, ""):
+                    if not self._running:
+                        break
+                    self._schedule_change()
+
+                self._process.wait()
+            except Exception as e:
+                self.logger.exception("Error while monitoring NetworkManager: {0}".format(e))
+
+            if not self._running:
+                break
+
+            # Reset the back-off after a child that ran for a while
+            if time.time() - started > self.max_backoff:
+                backoff = 1
+
+            self.logger.warn("NetworkManager monitor exited, restarting in {0} seconds".format(backoff))
+            time.sleep(backoff)
+            backoff = min(backoff * 2, self.max_backoff)
+
+    def _schedule_change(self):
+        with self._lock:
+            if self._timer or not self._running:
+                return
+
+            self._timer = threading.Timer(self.debounce, self._changed)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _changed(self):
+        with self._lock:
+            self._timer = None
+
+        try:
+            self.on_change()
+        except Exception as e:
+            self.logger.exception("Error while handling NetworkManager change: {0}".format(e))
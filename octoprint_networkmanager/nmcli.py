@@ -3,58 +3,460 @@ import subprocess
 import logging
 import re
 import os
+import signal
+import threading
+import time
 from random import randint
 
-from time import sleep
+IP_REGEX = re.compile('(?:(?:25[0-5]|2[0-4][0-9]|[01]?[0-9][0-9]?)\.){3}(?:25[0-5]|2[0-4][0-9]|[01]?[0-9][0-9]?)')
+STRING_REGEX = re.compile("string \"(.*)\"")
+UUID_REGEX = re.compile("UUID '([a-zA-Z0-9-]*)'")
+STATE_REGEX = re.compile("\\((.*)\\)")
+TRAILING_ZEROS_REGEX = re.compile(r'(\.0+)*$')
 
 class CommandTarget(object):
     NMCLI = "nmcli"
     DBUS = "dbus-send"
 
+class ReturnCode(object):
+    TIMEOUT = 124 # Same as timeout(1)
+    BUSY = 125
+
+class NmcliError(Exception):
+    """
+    Raised by the streaming reads when a command fails, times out or can't be queued, and when nmcli is too old
+    """
+    def __init__(self, returncode, message):
+        super(NmcliError, self).__init__(message)
+        self.returncode = returncode
+
+class CommandFlight(object):
+    """
+    A read command that is running, callers that send the same command wait for its result
+    """
+    def __init__(self):
+        self.result = (1, "Command failed")
+        self.done = threading.Event()
+
+class StreamFlight(object):
+    """
+    A streamed command that is running. A reader thread buffers its output lines, callers read them from the
+    buffer at their own pace, and callers that stream the same read command read the same buffer.
+    """
+    def __init__(self, max_lines):
+        self.lines = []
+        self.max_lines = max_lines
+        self.returncode = 0
+        self.error = None
+        self.done = False
+        self._condition = threading.Condition()
+
+    def append(self, line):
+        """
+        Buffers a line, returns False when the buffer is full
+        """
+        with self._condition:
+            if len(self.lines) >= self.max_lines:
+                return False
+
+            self.lines.append(line)
+            self._condition.notify_all()
+            return True
+
+    def finish(self, returncode = 0, error = None):
+        with self._condition:
+            self.returncode = returncode
+            self.error = error
+            self.done = True
+            self._condition.notify_all()
+
+    def __iter__(self):
+        index = 0
+        while True:
+            with self._condition:
+                while index >= len(self.lines) and not self.done:
+                    self._condition.wait()
+
+                if index >= len(self.lines):
+                    if self.error is not None:
+                        raise NmcliError(self.returncode, self.error)
+                    return
+
+                line = self.lines[index]
+            index += 1
+            yield line
+
+def split_terse_line(line):
+    """
+    Splits a line of nmcli terse output on the unescaped colons and unescapes the fields. nmcli escapes ':' and
+    '\\' in values with a backslash.
+    """
+    # Most lines have nothing escaped
+    if "\\" not in line:
+        return line.split(":")
+
+    # Swap the escape sequences for control characters, so the remaining colons can be split on directly
+    if "\x00" not in line and "\x01" not in line:
+        escaped = line.replace("\\\\", "\x01").replace("\\:", "\x00")
+
+        # A lone backslash at the end of the line is dropped
+        if escaped.endswith("\\"):
+            escaped = escaped[:-1]
+
+        return [field.replace("\x00", ":").replace("\x01", "\\") for field in escaped.split(":")]
+
+    return _split_terse_line_slow(line)
+
+
+def _split_terse_line_slow(line):
+    fields = []
+    field = None
+    for piece in line.split(":"):
+        field = piece if field is None else field + ":" + piece
+
+        # An odd number of backslashes before the colon means it was escaped and the field goes on
+        if (len(field) - len(field.rstrip("\\"))) % 2:
+            continue
+
+        fields.append(field.replace("\\:", ":").replace("\\\\", "\\"))
+        field = None
+
+    if field is not None:
+        fields.append(field[:-1].replace("\\:", ":").replace("\\\\", "\\"))
+
+    return fields
+
+
 class Nmcli(object):
 
-    def __init__(self):
+    # Commands with any of these words change NetworkManager's state and are never coalesced
+    WRITE_VERBS = ["modify", "mod", "up", "down", "delete", "add", "connect", "disconnect", "radio", "rescan", "reload", "edit"]
+
+    WIFI_LIST_COMMAND = ["-t", "-f", "ssid, bssid, signal, security", "dev", "wifi", "list"]
+    WIFI_LIST_KEYS = ["ssid", "bssid", "signal", "security"]
+
+    CONNECTIONS_COMMAND = ["-t", "-f", "name, uuid, type, autoconnect, dbus-path", "con", "show"]
+    CONNECTIONS_KEYS = ["name", "uuid", "type", "autoconnect", "dbus_path"]
+
+    # Streamed commands that write more lines are stopped, their output is buffered until it is read
+    MAX_STREAM_LINES = 100000
+
+    def __init__(self, connection_cache_ttl = 5, timeout = 10, connect_timeout = 90, max_processes = 2, max_queue = 16, streaming = False, command_observers = None):
 
-        logging.basicConfig(level=logging.INFO)
         self.logger = logging.getLogger("octoprint.plugins.networkmanager.nmcli")
 
+        # Commands are killed after timeout seconds, connecting may take as long as nmcli waits by itself.
+        # No more than max_processes commands run at once, with at most max_queue commands waiting for their turn.
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.max_queue = max_queue
+        self._process_slots = threading.BoundedSemaphore(max_processes)
+        self._queued = 0
+        self._queue_lock = threading.Lock()
+
+        # Commands that are running right now, and the most that ever ran at once
+        self.active_commands = 0
+        self.peak_commands = 0
+        self.rejected_commands = 0
+
+        # Identical read commands that run at the same time share one process
+        self.coalesced_commands = 0
+        self._flights = {}
+        self._stream_flights = {}
+        self._flights_lock = threading.Lock()
+
+        # Bumped after every write, reads only join flights that started after the last write finished
+        self._write_epoch = 0
+
+        # In streaming mode scans and connection lists are parsed line by line while nmcli is still writing them
+        self.streaming = streaming
+        self.scan_stats = dict(first_access_point=None, duration=None, count=0)
+
+        # Called with (target, command, returncode, output, latency) after every command that ran
+        self.command_observers = list(command_observers or [])
+
         try:
             self.check_nmcli_version()
         except ValueError as err:
-            self.logger.error("Nmcli incorrect version: {version}. Must be higher than 0.9.9.0".format(version=err.args[0]))
-            raise Exception
-
-        self.ip_regex = re.compile('(?:(?:25[0-5]|2[0-4][0-9]|[01]?[0-9][0-9]?)\.){3}(?:25[0-5]|2[0-4][0-9]|[01]?[0-9][0-9]?)')
-        self.string_regex = re.compile("string \"(.*)\"")
+            raise NmcliError(1, "Nmcli incorrect version: {version}. Must be higher than 0.9.9.0".format(version=err.args[0]))
 
         self.mac_addresses = { "wlan0": None, "eth0": None }
 
-    def _send_command(self, command, target = CommandTarget.NMCLI):
+        # Configured connections are asked for by most operations, cache them for a few seconds.
+        # Every method that changes the configured connections invalidates the cache.
+        self.connection_cache_ttl = connection_cache_ttl
+        self.connection_cache_stats = { "hits": 0, "misses": 0 }
+        self._connection_cache = None
+        self._connection_cache_time = 0
+        self._connection_cache_generation = 0
+        self._connection_cache_lock = threading.Lock()
+
+        # SSIDs of the active wifi connections by uuid, dev show only knows the profile name
+        self._connection_ssids = {}
+
+    def _send_command(self, command, target = CommandTarget.NMCLI, timeout = None):
         """
         Sends command to ncmli with subprocess.
-        Returns (0, output) of the command if succeeded, returns the exit code and output when errors
+        Returns (0, output) of the command if succeeded, returns the exit code and output when errors.
+        Returns ReturnCode.TIMEOUT when the command was killed after timeout seconds (default self.timeout),
+        and ReturnCode.BUSY when too many commands are waiting to be run.
+        A read command that is already running for another caller is not run again, its result is shared.
+        """
+
+        if not self._is_read_only(command):
+            return self._execute_command(command, target, timeout)
+
+        with self._flights_lock:
+            key = (target, tuple(command), self._write_epoch)
+            flight = self._flights.get(key)
+            leading = flight is None
+
+            if leading:
+                flight = self._flights[key] = CommandFlight()
+            else:
+                self.coalesced_commands += 1
+
+        if not leading:
+            self._log_command(command)
+            flight.done.wait()
+            return flight.result
+
+        try:
+            flight.result = self._execute_command(command, target, timeout)
+        finally:
+            with self._flights_lock:
+                del self._flights[key]
+            flight.done.set()
+
+        return flight.result
+
+    def _execute_command(self, command, target, timeout):
+        self._log_command(command)
+
+        if not self._acquire_process_slot(command):
+            return ReturnCode.BUSY, "Too many commands waiting"
+
+        started = time.time()
+        try:
+            returncode, output = self._run_command(command, target, timeout or self.timeout)
+        finally:
+            self._release_process_slot()
+
+            if not self._is_read_only(command):
+                with self._flights_lock:
+                    self._write_epoch += 1
+
+        self._notify_command_observers(target, command, returncode, output, time.time() - started)
+
+        # Error detected, return exit code and output + error
+        # Output is returned because nmcli reports error states in output and not in error ><
+        if returncode != 0:
+            self.logger.warn("Error while trying execute command {command}: output: {output}".format(command=[target] + command, output=output))
+
+        if not "show" in command and not "list" in command:
+            self._log_command_output(returncode, output)
+
+        return returncode, output
+
+    def _acquire_process_slot(self, command):
+        """
+        Waits for a free process slot. Returns False right away when too many commands are waiting already
+        """
+        with self._queue_lock:
+            if self._queued >= self.max_queue:
+                self.logger.warn("Too many commands waiting, not running {command}".format(command=command))
+                self.rejected_commands += 1
+                return False
+            self._queued += 1
+
+        self._process_slots.acquire()
+
+        with self._queue_lock:
+            self._queued -= 1
+            self.active_commands += 1
+            self.peak_commands = max(self.peak_commands, self.active_commands)
+
+        return True
+
+    def _release_process_slot(self):
+        with self._queue_lock:
+            self.active_commands -= 1
+
+        self._process_slots.release()
+
+    def _stream_command(self, command, target = CommandTarget.NMCLI, timeout = None):
         """
+        Sends command to nmcli and yields its output line by line while it is still running.
+        Raises NmcliError when the command fails, is killed after timeout seconds or can't be queued.
+        A reader thread buffers the output, so the process slot is released when nmcli exits and not when the
+        caller has read the last line. A read command that is already streamed for another caller is not run
+        again, its output is shared.
+        """
+        read_only = self._is_read_only(command)
+
+        with self._flights_lock:
+            key = (target, tuple(command), self._write_epoch)
+            flight = self._stream_flights.get(key) if read_only else None
+            leading = flight is None
+
+            if leading:
+                flight = StreamFlight(self.MAX_STREAM_LINES)
+                if read_only:
+                    self._stream_flights[key] = flight
+            else:
+                self.coalesced_commands += 1
 
         self._log_command(command)
 
-        command[:0] = [target]
+        if leading:
+            if not self._acquire_process_slot(command):
+                self._end_stream_flight(key, flight)
+                flight.finish(ReturnCode.BUSY, "Too many commands waiting")
+            else:
+                reader = threading.Thread(target=self._read_stream, args=(flight, key, command, target, timeout),
+                                          name="nmcli stream reader")
+                reader.daemon = True
+                reader.start()
+
+        for line in flight:
+            yield line
+
+    def _read_stream(self, flight, key, command, target, timeout):
+        """
+        Reads the output of a streamed command into its flight, holding a process slot until the command exits
+        """
+        returncode = 0
+        error = None
+        started = time.time()
+
         try:
-            result = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-            output, _ = result.communicate()
+            lines = self._run_command_lines(command, target, timeout or self.timeout)
+            try:
+                for line in lines:
+                    if not flight.append(line):
+                        self.logger.warn("Command {command} wrote more than {count} lines, stopping it".format(command=[target] + command, count=flight.max_lines))
+                        returncode, error = 1, "Command wrote more than {0} lines".format(flight.max_lines)
+                        break
+            finally:
+                # Kills the process when it is still running
+                lines.close()
+        except NmcliError as err:
+            returncode, error = err.returncode, str(err)
+        except Exception as err:
+            self.logger.exception("Error while streaming {command}".format(command=[target] + command))
+            returncode, error = 1, str(err)
+        finally:
+            self._release_process_slot()
+            self._end_stream_flight(key, flight)
+            flight.finish(returncode, error)
+
+        self._notify_command_observers(target, command, returncode, "\n".join(flight.lines), time.time() - started)
+
+    def _end_stream_flight(self, key, flight):
+        # Callers that come later start their own command
+        with self._flights_lock:
+            if self._stream_flights.get(key) is flight:
+                del self._stream_flights[key]
+
+    def _notify_command_observers(self, target, command, returncode, output, latency):
+        for observer in self.command_observers:
+            try:
+                observer(target, command, returncode, output, latency)
+            except Exception as e:
+                self.logger.exception("Error in command observer: {0}".format(e))
+
+    def _run_command_lines(self, command, target, timeout):
+        """
+        Like _run_command, but yields the output lines as they are written. The process is killed when the
+        caller stops reading early.
+        """
+        try:
+            process = subprocess.Popen([target] + command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, preexec_fn=os.setsid)
+        except OSError as err:
+            self.logger.warn("OSError: {error}, file: {filename}, error: {message}".format(error=err.errno, filename=err.filename, message=err.strerror))
+            raise NmcliError(1, err.strerror)
 
-            # Error detected, return exit code and output + error
-            # Output is returned because nmcli reports error states in output and not in error ><
-            if result.returncode != 0:
-                self.logger.warn("Error while trying execute command {command}: output: {output}".format(command=command, output=output))
+        killed = []
+        timer = None
+        if timeout:
+            timer = threading.Timer(timeout, self._kill_process, args=(process, killed))
+            timer.daemon = True
+            timer.start()
 
-            if not "show" in command and not "list" in command:
-                self._log_command_output(result.returncode, output)
+        try:
+            # readline instead of iterating the file, which reads ahead in blocks
+            for line in iter(process.stdout.readline, ""):
+                yield line.rstrip("\n")
+
+            process.wait()
+        finally:
+            if timer:
+                timer.cancel()
+            if process.poll() is None:
+                self._kill_process(process, killed)
+                process.wait()
+            process.stdout.close()
+
+        if killed:
+            self.logger.warn("Command {command} did not finish within {timeout} seconds".format(command=[target] + command, timeout=timeout))
+            raise NmcliError(ReturnCode.TIMEOUT, "Command did not finish within {0} seconds".format(timeout))
+
+        if process.returncode != 0:
+            self.logger.warn("Error while trying execute command {command}: exit code {returncode}".format(command=[target] + command, returncode=process.returncode))
+            raise NmcliError(process.returncode, "Command failed with exit code {0}".format(process.returncode))
+
+    def _is_read_only(self, command):
+        for verb in self.WRITE_VERBS:
+            if verb in command:
+                return False
+        return True
 
-            return result.returncode, output
+    def _run_command(self, command, target, timeout):
+        """
+        Runs the command in its own process group, which is killed when it takes longer than timeout seconds
+        """
+        try:
+            process = subprocess.Popen([target] + command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, preexec_fn=os.setsid)
         except OSError as err:
             self.logger.warn("OSError: {error}, file: {filename}, error: {message}".format(error=err.errno, filename=err.filename, message=err.strerror))
             return 1, err.strerror
 
+        killed = []
+        timer = None
+        if timeout:
+            timer = threading.Timer(timeout, self._kill_process, args=(process, killed))
+            timer.daemon = True
+            timer.start()
+
+        try:
+            output, _ = process.communicate()
+        finally:
+            if timer:
+                timer.cancel()
+
+        if killed:
+            self.logger.warn("Command {command} did not finish within {timeout} seconds".format(command=[target] + command, timeout=timeout))
+            return ReturnCode.TIMEOUT, output
+
+        return process.returncode, output
+
+    def _kill_process(self, process, killed):
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+            killed.append(process.pid)
+        except OSError:
+            # Finished just in time
+            pass
+
+    def start_monitor(self):
+        """
+        Starts nmcli monitor and returns the process. Every line on its stdout is a change notification.
+        """
+        command = ["monitor"]
+        self._log_command(command)
+
+        return subprocess.Popen([CommandTarget.NMCLI] + command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+
     def scan_wifi(self, force=False):
         """
         Scans wifi acces points and returns list of cells
@@ -66,9 +468,16 @@ class Nmcli(object):
         if force:
             self.rescan_wifi()
 
-        command = ["-t", "-f", "ssid, signal, security", "dev", "wifi", "list"]
+        if self.streaming:
+            try:
+                # Only the strongest access point of every SSID is kept while the list is read
+                return self._filter_cells(self.iter_wifi_cells()) or None
+            except NmcliError:
+                return None
+
+        command = self.WIFI_LIST_COMMAND
         # Keys to map the out put to, same as fields describes in the command
-        keys = ["ssid", "signal", "security"]
+        keys = self.WIFI_LIST_KEYS
 
         # Parse command
         returncode, output = self._send_command(command)
@@ -79,29 +488,68 @@ class Nmcli(object):
         if not output:
             return None
 
-        parse = self._sanatize_parse(output)
-
         # Map output to dict with keys[]
-        cells = self._map_parse(parse, keys)
+        cells = self._sanatize_parse_map(output, keys)
 
-        configured_connections = self.get_configured_connections()
+        connection_uuids = self._get_connection_uuid_index()
 
         for cell in cells:
             # Ensure signal is an int
             cell["signal"] = int(cell["signal"])
 
             # Extend cells with connection properties
-            cell["connection_uuid"] = None
-            if configured_connections:
-                for connection in configured_connections:
-                    if cell["ssid"] == connection["name"]:
-                        cell["connection_uuid"] = connection["uuid"]
-                        break
+            cell["connection_uuid"] = connection_uuids.get(cell["ssid"], None)
 
         # Filter duplicates and return keep only highest signal entry
         cells = self._filter_cells(cells)
         return cells
 
+    def iter_wifi_cells(self):
+        """
+        Yields the access points of the wifi list as they are parsed, without filtering duplicate SSIDs.
+        The time to the first access point and the whole list are kept in scan_stats.
+        Raises NmcliError when the list can't be read.
+        """
+        started = time.time()
+        count = 0
+
+        for cell in self._iter_wifi_cells():
+            if count == 0:
+                self.scan_stats["first_access_point"] = time.time() - started
+            count += 1
+            yield cell
+
+        if count == 0:
+            self.scan_stats["first_access_point"] = None
+        self.scan_stats["duration"] = time.time() - started
+        self.scan_stats["count"] = count
+
+    def _iter_wifi_cells(self):
+        # Read the connections before the list, the list holds a process slot while it is read
+        connection_uuids = self._get_connection_uuid_index()
+
+        for line in self._stream_command(self.WIFI_LIST_COMMAND):
+            cell = dict(zip(self.WIFI_LIST_KEYS, split_terse_line(line)))
+            cell["signal"] = int(cell["signal"])
+            cell["connection_uuid"] = connection_uuids.get(cell["ssid"], None)
+            yield cell
+
+    def _get_connection_uuid_index(self):
+        """
+        Returns a dict that maps SSIDs to the uuid of the first wifi connection with that SSID
+        """
+        connections = [connection for connection in self.get_configured_connections() or []
+                       if connection["type"] == "Wireless"]
+        ssids = self._get_connection_ssids([connection["uuid"] for connection in connections])
+
+        index = {}
+        for connection in connections:
+            ssid = ssids.get(connection["uuid"])
+            if ssid:
+                index.setdefault(ssid, connection["uuid"])
+
+        return index
+
     def rescan_wifi(self):
         """
         Rescans the wifi APS
@@ -128,57 +576,169 @@ class Nmcli(object):
 
         result = {}
 
-        interfaces = self.get_interfaces()
-        if interfaces:
-            for key, interface in interfaces.iteritems():
-                props = {}
+        devices = self.get_devices()
+        if devices:
+            ssids = self._get_connection_ssids([device["connection_uuid"] for key, device in devices.iteritems()
+                                                if key == "wifi" and device["connection_uuid"]])
 
-                if interface["connection_uuid"]:
-                    details = self.get_configured_connection_details(interface["connection_uuid"], read_psk = False)
+            for key, device in devices.iteritems():
+                props = {}
 
-                    if details:
-                        props["ssid"] = details["ssid"] if "ssid" in details else None
-                        props["ip"] = details["ipv4"]["active_ip"]
+                if device["connection_uuid"]:
+                    props["ssid"] = ssids.get(device["connection_uuid"]) if key == "wifi" else None
+                    props["ip"] = device["ip"]
 
-                # Copy properties from interface
-                props["connection_uuid"] = interface["connection_uuid"]
-                props["connected"] = interface["connected"]
-                props["enabled"] = interface["enabled"]
-                props["mac_address"] = interface["mac_address"]
+                # Copy properties from device
+                props["connection_uuid"] = device["connection_uuid"]
+                props["connected"] = device["connected"]
+                props["enabled"] = device["enabled"]
+                props["mac_address"] = device["mac_address"]
 
                 result[key] = props
 
         return result
 
+    def _get_connection_ssids(self, uuids):
+        """
+        Returns the SSIDs of the connections by uuid. The profile name is not the SSID, so connections that were
+        not seen before are read with one con show, after that they are answered from memory.
+        """
+        with self._connection_cache_lock:
+            missing = [uuid for uuid in uuids if uuid not in self._connection_ssids]
+
+        if missing:
+            details = self.get_configured_connection_details_many(missing, read_psk=False) or []
+
+            with self._connection_cache_lock:
+                for connection in details:
+                    self._connection_ssids[connection["uuid"]] = connection["ssid"]
+
+        with self._connection_cache_lock:
+            return dict((uuid, self._connection_ssids.get(uuid)) for uuid in uuids)
+
+    def get_devices(self):
+        """
+        Return state, mac address, active ip and active connection of all devices with one nmcli call.
+        For example {'wifi': { 'device': 'wlan0', 'connection_uuid': '1234-ab-..', 'connection_name': 'MyWifi',
+                               'enabled': True, 'connected': True, 'mac_address': 'B8:27:EB:..', 'ip': '192.168.1.5' }}
+        """
+        command = ["-t", "-f", "GENERAL,IP4,CONNECTIONS", "dev", "show"]
+
+        returncode, output = self._send_command(command)
+
+        if returncode != 0:
+            return None
+
+        devices = {}
+
+        for record in self._sanatize_parse_records(output):
+            if not "GENERAL.DEVICE" in record or not "GENERAL.TYPE" in record:
+                self.logger.warning("Unparsable NMCLI output detected")
+                continue
+
+            device_type = record["GENERAL.TYPE"]
+            if device_type == "loopback":
+                continue
+
+            device = record["GENERAL.DEVICE"]
+            state = self._get_device_state(record.get("GENERAL.STATE", ""))
+
+            connection_name = record.get("GENERAL.CONNECTION", "")
+            if connection_name == "--":
+                connection_name = ""
+
+            connection_uuid = record.get("GENERAL.CON-UUID", "")
+            if connection_uuid == "--":
+                connection_uuid = ""
+
+            mac_address = record.get("GENERAL.HWADDR", None)
+            if mac_address:
+                self.mac_addresses[device] = mac_address
+
+            # Systems with more devices of a type report the connected one, or else the first
+            if device_type in devices and (devices[device_type]["connected"] or state != "connected"):
+                continue
+
+            devices[device_type] = {
+                "device": device,
+                "connection_uuid": connection_uuid or None,
+                "connection_name": connection_name or None,
+                "enabled": state != "unavailable" and state != "unmanaged",
+                "connected": state == "connected",
+                "mac_address": mac_address or None,
+                "ip": self._get_ipv4_address(record.get("IP4.ADDRESS[1]", ""))
+                }
+
+        return devices
+
     def get_configured_connections(self):
         """
         Get all configured connections for wireless and wired configurations
         """
-        command = ["-t", "-f", "name, uuid, type, autoconnect, dbus-path", "con", "show" ]
-        keys = ["name", "uuid", "type", "autoconnect", "dbus_path" ]
+        with self._connection_cache_lock:
+            if self._connection_cache is not None and time.time() - self._connection_cache_time < self.connection_cache_ttl:
+                self.connection_cache_stats["hits"] += 1
+                return [dict(connection) for connection in self._connection_cache]
 
-        returncode, output = self._send_command(command)
+            self.connection_cache_stats["misses"] += 1
+            generation = self._connection_cache_generation
+
+        configured_connections = self._read_configured_connections()
+
+        if configured_connections is not None:
+            with self._connection_cache_lock:
+                # Don't cache a result that was read while the connections changed
+                if generation == self._connection_cache_generation:
+                    self._connection_cache = [dict(connection) for connection in configured_connections]
+                    self._connection_cache_time = time.time()
+
+        return configured_connections
+
+    def invalidate_configured_connections(self):
+        """
+        Drops the cached configured connections, the next get_configured_connections will read them again
+        """
+        with self._connection_cache_lock:
+            self._connection_cache = None
+            self._connection_cache_generation += 1
+            self._connection_ssids = {}
+
+    def _read_configured_connections(self):
+        if self.streaming:
+            try:
+                return list(self.iter_configured_connections())
+            except NmcliError:
+                return None
+
+        returncode, output = self._send_command(self.CONNECTIONS_COMMAND)
 
         if returncode != 0:
             return None
 
-        parse = self._sanatize_parse(output)
+        configured_connections = self._sanatize_parse_map(output, self.CONNECTIONS_KEYS)
 
-        configured_connections = self._map_parse(parse, keys)
-        
         # Sanatize the connection name a bit
         if configured_connections:
             for connection in configured_connections:
-                if "wireless" in connection.get("type", ""):
-                    connection["type"] = "Wireless"
-                if "ethernet" in connection.get("type", ""):
-                    connection["type"] = "Wired"
-                
-                # string to boolean
-                connection["autoconnect"] = connection.get("autoconnect", "yes") == "yes"
+                self._sanatize_connection(connection)
 
         return configured_connections
 
+    def iter_configured_connections(self):
+        """
+        Yields the configured connections as they are parsed. Bypasses the connection cache.
+        Raises NmcliError when the connections can't be read.
+        """
+        for line in self._stream_command(self.CONNECTIONS_COMMAND):
+            yield self._sanatize_connection(dict(zip(self.CONNECTIONS_KEYS, split_terse_line(line))))
+
+    def _sanatize_connection(self, connection):
+        connection["type"] = self._get_connection_type(connection.get("type", ""))
+
+        # string to boolean
+        connection["autoconnect"] = connection.get("autoconnect", "yes") == "yes"
+        return connection
+
     def delete_configured_connection(self, uuid):
         """
         Deletes a configured connection. Takes uuid as input
@@ -187,6 +747,7 @@ class Nmcli(object):
         command = ["con", "delete", "uuid", uuid]
         
         result = self._send_command(command)
+        self.invalidate_configured_connections()
 
         if result[0]:
             self.logger.warn("An error occurred deleting a connection")
@@ -205,31 +766,66 @@ class Nmcli(object):
             details = self._sanatize_parse_key_value(output)
             
             if details:
+                return self._get_connection_details(details, uuid, read_psk)
 
-                isWireless = "wireless" in details.get("connection.type", "")
-
-                psk = ""
-
-                if read_psk and isWireless:
-                    psk = self._get_psk(uuid)
-
-                result = {
-                    "uuid": details.get("connection.uuid", uuid),
-                    "name": self._get_connection_name(details),
-                    "autoconnect": details.get("connection.autoconnect", "yes") == "yes",
-                    "isWireless": isWireless,
-                    "ssid": self._get_connection_ssid(details),
-                    "psk": psk,
-                    "ipv4": {
-                        "method": details.get("ipv4.method", None),
-                        "ip": self._get_ipv4_address(details.get("ipv4.addresses", "")), # Manually Configured IP address
-                        "active_ip": self._get_ipv4_address(details.get("IP4.ADDRESS[1]", "")),
-                        "gateway": self._get_gateway_ipv4_address(details.get("ipv4.addresses", "")),
-                        "dns": details.get("ipv4.dns","").replace(",","").split()
-                        }
-                    }
+    def get_configured_connection_details_many(self, uuids = None, read_psk = False):
+        """
+        Get the details of multiple configured connections with one nmcli call. Takes a list of uuids, or all
+        configured connections if no uuids are given. Returns a list of details in the same form as
+        get_configured_connection_details.
+        """
+        if uuids is None:
+            connections = self.get_configured_connections()
+            if connections is None:
+                return None
+            uuids = [connection["uuid"] for connection in connections]
+
+        if not uuids:
+            return []
+
+        command = ["-t", "con", "show"] + list(uuids)
 
-                return result
+        returncode, output = self._send_command(command)
+
+        if returncode != 0:
+            # nmcli fails the whole call when one of the connections is gone, so fetch the others one by one
+            self.logger.warn("Could not read connection details in one go, falling back to one call per connection")
+            result = []
+            for uuid in uuids:
+                details = self.get_configured_connection_details(uuid, read_psk)
+                if details:
+                    result.append(details)
+            return result
+
+        return [self._get_connection_details(details, details.get("connection.uuid"), read_psk)
+                for details in self._sanatize_parse_records(output)]
+
+    def _get_connection_details(self, details, uuid, read_psk):
+        """
+        Maps the key-value pairs of nmcli con show to connection details
+        """
+        isWireless = "wireless" in details.get("connection.type", "")
+
+        psk = ""
+
+        if read_psk and isWireless:
+            psk = self._get_psk(uuid)
+
+        return {
+            "uuid": details.get("connection.uuid", uuid),
+            "name": self._get_connection_name(details),
+            "autoconnect": details.get("connection.autoconnect", "yes") == "yes",
+            "isWireless": isWireless,
+            "ssid": self._get_connection_ssid(details),
+            "psk": psk,
+            "ipv4": {
+                "method": details.get("ipv4.method", None),
+                "ip": self._get_ipv4_address(details.get("ipv4.addresses", "")), # Manually Configured IP address
+                "active_ip": self._get_ipv4_address(details.get("IP4.ADDRESS[1]", "")),
+                "gateway": self._get_gateway_ipv4_address(details.get("ipv4.addresses", "")),
+                "dns": details.get("ipv4.dns","").replace(",","").split()
+                }
+            }
 
     def set_configured_connection_details(self, interface, connection_details, uuid = None):
                 
@@ -288,11 +884,12 @@ class Nmcli(object):
 
         # Save changes to connection
         exitcode, _ = self._send_command(command)
+        self.invalidate_configured_connections()
 
         # Apply changes
         if connection_details["autoconnect"]:
             command = [ "con", "up", uuid ]
-            exitcode, _ = self._send_command(command)
+            exitcode, _ = self._send_command(command, timeout=self.connect_timeout)
 
         return exitcode == 0
 
@@ -340,6 +937,7 @@ class Nmcli(object):
             if device:
                 command = ["dev", "disconnect", device] # This will set autoconnect to false
                 returncode, _ = self._send_command(command)
+                self.invalidate_configured_connections()
                 return returncode == 0
             else:
                 # Apparantly we're disconnected already
@@ -364,7 +962,7 @@ class Nmcli(object):
             for connection in connections:
                 if connection["type"] == wanted_type and connection["autoconnect"]:
                     command = ["con", "up", connection["uuid"]]
-                    returncode, _ = self._send_command(command)
+                    returncode, _ = self._send_command(command, timeout=self.connect_timeout)
 
                     # Only break on success. Otherwise try other connections.
                     if returncode == 0:
@@ -433,9 +1031,7 @@ class Nmcli(object):
         if returncode != 0:
             return None
 
-        parse = self._sanatize_parse(output)
-
-        connections = self._map_parse(parse, keys)
+        connections = self._sanatize_parse_map(output, keys)
 
         return connections
 
@@ -463,11 +1059,12 @@ class Nmcli(object):
 
         self.logger.info("Trying to create new connection for {0}".format(ssid))
         
-        returncode, output = self._send_command(command)
+        returncode, output = self._send_command(command, timeout=self.connect_timeout)
+        self.invalidate_configured_connections()
 
         if returncode == 0:
             # Extract the UUID from the output
-            search = re.search("UUID '([a-zA-Z0-9-]*)'", output)
+            search = UUID_REGEX.search(output)
             if search:
                 found = search.group(1)
                 return found
@@ -477,15 +1074,6 @@ class Nmcli(object):
         else:
             return None
 
-    def reset_wifi(self):
-        """
-        Resets the wifi by turning it on and off with sleep of 5 seconds
-        """
-        self._send_command(["radio", "wifi", "off"])
-        sleep(5)
-        self._send_command(["radio", "wifi", "on"])
-        self.logger.info("Wifi reset")
-
     def get_interfaces(self):
         """
         Return list of interfaces
@@ -557,7 +1145,7 @@ class Nmcli(object):
 
         ip = None
         for elem in parse[0]:
-            match = self.ip_regex.search(elem)
+            match = IP_REGEX.search(elem)
             if match:
                 ip = match.group()
 
@@ -576,45 +1164,76 @@ class Nmcli(object):
         Sanatizes the parse. using the -t command of nmli, ':' is used to split
         """
         if output:
-            parse = output.splitlines()
-            parse_split = []
-            for line in parse:
-                results = list(self._split_nmcli_output(line))
-                parse_split.append(results)
-            return parse_split
-    
+            return [split_terse_line(line) for line in output.splitlines()]
+
+    def _sanatize_parse_map(self, output, keys):
+        """
+        Sanatizes the parse and maps every line to a dict with keys[] in one pass, the same as
+        _map_parse(_sanatize_parse(output), keys)
+        """
+        if not output:
+            return []
+        return [dict(zip(keys, split_terse_line(line))) for line in output.splitlines()]
+
     def _sanatize_parse_key_value(self, output):
         """
         Sanatizes the parse. using the -t command of nmli, ':' is used to split. Returns key-value pairs
         """
         #Check if command executed correctly[returncode 0], otherwise return nothing
         if output:
-            parse = output.splitlines()
-            parse_split = {}
-            for line in parse:
-                
-                # An empty line indicates a new connection entry. We only parse the first.
-                if not line:
-                    break
+            # An empty line indicates a new connection entry. We only parse the first.
+            records = self._sanatize_parse_records(output)
+            return records[0] if records else {}
 
+    def _sanatize_parse_records(self, output):
+        """
+        Sanatizes the parse of multiline terse output that describes multiple records, like dev show or con show
+        with multiple ids. Returns a list with a key-value dict for every record.
+        """
+        records = []
+
+        if output:
+            record = {}
+            for line in output.splitlines():
                 line = line.split(":", 1)
-                if len(line) == 2:
-                    parse_split[line[0]] = line[1]
-            return parse_split
+
+                # Records are separated by an empty line, a repeated key also starts a new record
+                if len(line) != 2 or line[0] in record:
+                    if record:
+                        records.append(record)
+                        record = {}
+                    if len(line) != 2:
+                        continue
+
+                value = line[1]
+                if "\\" in value:
+                    value = value.replace("\\:", ":").replace("\\\\", "\\")
+                record[line[0]] = value
+
+            if record:
+                records.append(record)
+
+        return records
 
     def _filter_cells(self, cells):
         """
-        Filter cells dictionary to remove duplicates and only keep the entry with the highest signal value
+        Filter cells dictionary to remove duplicates and only keep the entry with the highest signal value.
+        The BSSIDs of all access points with the same SSID are collected in bssids.
         """
         filtered = {}
+        bssids = {}
         for cell in cells:
             ssid = cell["ssid"]
+            bssids.setdefault(ssid, set()).add(cell.get("bssid"))
             if ssid in filtered:
                 if cell["signal"] > filtered[ssid]["signal"]:
                     filtered[ssid] = cell
             else:
                 filtered[ssid] = cell 
 
+        for ssid, cell in filtered.items():
+            cell["bssids"] = sorted(bssid for bssid in bssids[ssid] if bssid)
+
         return filtered.values()
 
     def check_nmcli_version(self):
@@ -641,6 +1260,22 @@ class Nmcli(object):
         else:
             return None
 
+    def _get_device_state(self, state):
+        """
+        Returns the state name of a GENERAL.STATE value, for example connected for "100 (connected)"
+        """
+        match = STATE_REGEX.search(state)
+        if match:
+            return match.group(1)
+        return state
+
+    def _get_connection_type(self, connection_type):
+        if "wireless" in connection_type:
+            return "Wireless"
+        if "ethernet" in connection_type:
+            return "Wired"
+        return connection_type
+
     def _get_connection_name(self, connection_details):
         name = connection_details.get("802-11-wireless.ssid", "")
         return name if name else "Wired"
@@ -651,7 +1286,7 @@ class Nmcli(object):
 
         split = ip_details.split(",")
 
-        match = self.ip_regex.search(split[0])
+        match = IP_REGEX.search(split[0])
         if match:
             return match.group()
 
@@ -664,7 +1299,7 @@ class Nmcli(object):
         if len(split) < 2:
             return None
 
-        match = self.ip_regex.search(split[1])
+        match = IP_REGEX.search(split[1])
         if match:
             return match.group()
 
@@ -698,7 +1333,7 @@ class Nmcli(object):
             psk = None
 
             # Iterate over all strings in the result, and return the string after "psk"
-            for match in self.string_regex.finditer(output):
+            for match in STRING_REGEX.finditer(output):
 
                 if last == "psk":
                     return match.group(1) # group(1) to get only the string contents
@@ -718,33 +1353,8 @@ class Nmcli(object):
 
     def vercmp(self, actual, test):
         def normalize(v):
-            return [int(x) for x in re.sub(r'(\.0+)*$', '', v).split(".")]
+            return [int(x) for x in TRAILING_ZEROS_REGEX.sub('', v).split(".")]
         return cmp(normalize(actual), normalize(test))
 
     def _split_nmcli_output(self, line):
-        result = []
-        for item in self._split_esc(line, ":"):
-            result.append(item.replace("\:",":").replace("\\\\", "\\"))
-
-        return result
-
-    def _split_esc(self, string, delimiter):
-        """Helper method that allows to split with an escaped character (nmcli escapes the : if needed)"""
-        if len(delimiter) != 1:
-            raise ValueError('Invalid delimiter: ' + delimiter)
-        ln = len(string)
-        i = 0
-        j = 0
-        
-        while j < ln:
-            if string[j] == '\\':
-                if j + 1 >= ln:
-                    yield string[i:j]
-                    return
-                j += 1
-            elif string[j] == delimiter:
-                yield string[i:j]
-                i = j + 1
-            j += 1
-        yield string[i:j]
-
+        return split_terse_line(line)
@@ -0,0 +1,117 @@
+# coding=utf-8
+import cProfile
+import logging
+import os
+import re
+import threading
+import time
+
+PROFILE_EXTENSION = ".pstats"
+
+
+class Profiler(object):
+    """
+    Profiles blueprint requests with cProfile once it is armed, for the next number of requests or until a time
+    has passed, and saves a .pstats file per request in folder. Only the keep newest files are kept.
+
+    The profile covers the thread that answers the request, from before the handler until the request is torn
+    down, which includes generating the body of a streamed response.
+    """
+
+    def __init__(self, folder, keep = 20):
+        self.logger = logging.getLogger("octoprint.plugins.networkmanager.profiling")
+
+        self.folder = folder
+        self.keep = keep
+
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._remaining = 0
+        self._until = None
+
+    def arm(self, requests = None, seconds = None):
+        with self._lock:
+            self._remaining = requests or 0
+            self._until = time.time() + seconds if seconds else None
+
+        self.logger.info("Profiling the next {0} requests for {1} seconds".format(requests or "-", seconds or "-"))
+
+    def disarm(self):
+        with self._lock:
+            self._remaining = 0
+            self._until = None
+
+    @property
+    def armed(self):
+        return self._remaining > 0 or (self._until is not None and time.time() < self._until)
+
+    def as_dict(self):
+        return dict(
+            armed=self.armed,
+            remainingRequests=self._remaining,
+            remainingSeconds=max(0, self._until - time.time()) if self._until else 0
+        )
+
+    def start_request(self, route, method):
+        with self._lock:
+            if self._remaining > 0:
+                self._remaining -= 1
+            elif self._until is None or time.time() >= self._until:
+                return None
+
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError as e:
+            # Another profiler is already active on this thread
+            self.logger.warn("Could not profile {0} {1}: {2}".format(method, route, e))
+            return None
+
+        self._local.request = (profile, route, method, time.time())
+        return profile
+
+    def finish_request(self):
+        request = getattr(self._local, "request", None)
+        if request is None:
+            return None
+
+        self._local.request = None
+        profile, route, method, started = request
+        profile.disable()
+
+        if not os.path.isdir(self.folder):
+            os.makedirs(self.folder)
+
+        # Like 20240101-120000-123-GET-connection_details-id.pstats
+        name = "{0}-{1:03d}-{2}-{3}{4}".format(time.strftime("%Y%m%d-%H%M%S", time.localtime(started)),
+                                               int(started * 1000) % 1000, method,
+                                               re.sub(r"[^A-Za-z0-9]+", "_", route).strip("_") or "root",
+                                               PROFILE_EXTENSION)
+        profile.dump_stats(os.path.join(self.folder, name))
+
+        self._remove_old_profiles()
+        return name
+
+    def list_profiles(self):
+        """
+        Returns the saved profiles, newest first
+        """
+        if not os.path.isdir(self.folder):
+            return []
+
+        profiles = []
+        for name in os.listdir(self.folder):
+            if not name.endswith(PROFILE_EXTENSION):
+                continue
+
+            path = os.path.join(self.folder, name)
+            profiles.append(dict(name=name, size=os.path.getsize(path), date=os.path.getmtime(path)))
+
+        return sorted(profiles, key=lambda profile: profile["date"], reverse=True)
+
+    def _remove_old_profiles(self):
+        for profile in self.list_profiles()[self.keep:]:
+            try:
+                os.remove(os.path.join(self.folder, profile["name"]))
+            except OSError as e:
+                self.logger.warn("Could not remove the profile {0}: {1}".format(profile["name"], e))
@@ -0,0 +1,74 @@
+# coding=utf-8
+import threading
+import time
+
+from nmcli import Nmcli, NmcliError, CommandTarget
+from capture import read_capture, redact_command
+
+
+class ReplayNmcli(Nmcli):
+    """
+    Nmcli backend that answers commands from a capture file recorded with CaptureWriter, instead of running them.
+
+    A command gets the recorded answers to the same command in the order they were recorded, the last one is
+    repeated once they are used up. With realtime every answer takes as long as the recorded command did,
+    otherwise answers are returned as fast as possible. Commands that are not in the capture fail.
+    """
+
+    def __init__(self, capture, realtime = False, **kwargs):
+        self.capture = capture
+        self.realtime = realtime
+        self.unknown_commands = 0
+
+        self._entries = {}
+        self._positions = {}
+        self._lock = threading.Lock()
+
+        for entry in read_capture(capture):
+            key = (entry.get("target", CommandTarget.NMCLI), tuple(entry["command"]))
+            self._entries.setdefault(key, []).append(entry)
+
+        # Checks the (recorded) nmcli version, so the capture has to be loaded first
+        super(ReplayNmcli, self).__init__(**kwargs)
+
+        self.logger.info("Replaying {0} commands from {1}".format(sum(len(entries) for entries in self._entries.values()), capture))
+
+    def _run_command(self, command, target, timeout):
+        entry = self._next_entry(command, target)
+
+        if entry is None:
+            self.unknown_commands += 1
+            self.logger.warn("Command {0} is not in the capture".format([target] + command))
+            return 1, "Error: Command is not in the capture"
+
+        if self.realtime and entry.get("latency"):
+            time.sleep(entry["latency"])
+
+        return entry["returncode"], entry["output"]
+
+    def _run_command_lines(self, command, target, timeout):
+        returncode, output = self._run_command(command, target, timeout)
+
+        if returncode != 0:
+            raise NmcliError(returncode, output)
+
+        for line in (output or "").splitlines():
+            yield line
+
+    def _next_entry(self, command, target):
+        # Secrets were redacted when the capture was recorded
+        key = (target, tuple(redact_command(command)))
+
+        with self._lock:
+            entries = self._entries.get(key)
+            if not entries:
+                return None
+
+            position = self._positions.get(key, 0)
+            self._positions[key] = position + 1
+            return entries[min(position, len(entries) - 1)]
+
+    def start_monitor(self):
+        # The capture has no change notifications, the monitor just stays quiet
+        from mockingnmcli import MonitorProcessMock
+        return MonitorProcessMock()
@@ -0,0 +1,330 @@
+# coding=utf-8
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+import zlib
+
+# Snapshots of another layout are ignored
+SNAPSHOT_VERSION = 1
+
+
+class AccessPointTable(object):
+    """
+    The access points of the last scans keyed by SSID. Entries are updated in place and every change bumps the
+    revision, so clients that know a revision can ask for only the entries that were added, changed or removed
+    since. Not thread safe, NetworkState guards it.
+
+    Signal strength moves a little on every scan, an entry only counts as changed when its signal moved by at
+    least signal_threshold, smaller moves keep the known entry.
+    """
+
+    def __init__(self, keep_removed = 1000, signal_threshold = 10):
+        self.keep_removed = keep_removed
+        self.signal_threshold = signal_threshold
+
+        # Start where no revision of an earlier run can be, so old clients never get a delta that doesn't apply
+        self.revision = int(time.time() * 1000)
+
+        self._entries = {}
+        self._created = {}
+        self._modified = {}
+        self._removed = {}
+        self._oldest_delta = self.revision
+
+    def update(self, wifis):
+        """
+        Updates the table with a new scan. Returns True when anything changed
+        """
+        revision = self.revision + 1
+        changed = False
+        seen = set()
+
+        for wifi in wifis:
+            ssid = wifi["ssid"]
+            seen.add(ssid)
+
+            if ssid not in self._entries:
+                self._created[ssid] = revision
+                self._removed.pop(ssid, None)
+            elif not self._is_changed(self._entries[ssid], wifi):
+                continue
+
+            self._entries[ssid] = wifi
+            self._modified[ssid] = revision
+            changed = True
+
+        for ssid in [ssid for ssid in self._entries if ssid not in seen]:
+            del self._entries[ssid]
+            del self._created[ssid]
+            del self._modified[ssid]
+            self._removed[ssid] = revision
+            changed = True
+
+        if changed:
+            self.revision = revision
+            self._prune_removed()
+
+        return changed
+
+    def _is_changed(self, known, wifi):
+        for key in set(known) | set(wifi):
+            if key == "signal":
+                if abs((known.get(key) or 0) - (wifi.get(key) or 0)) >= self.signal_threshold:
+                    return True
+            elif known.get(key) != wifi.get(key):
+                return True
+        return False
+
+    def list(self):
+        return [self._entries[ssid] for ssid in sorted(self._entries)]
+
+    def can_delta(self, since):
+        return since is not None and self._oldest_delta <= since <= self.revision
+
+    def delta(self, since):
+        """
+        Returns the entries that were added, changed and removed after revision since
+        """
+        added = []
+        changed = []
+
+        for ssid in sorted(self._entries):
+            if self._created[ssid] > since:
+                added.append(self._entries[ssid])
+            elif self._modified[ssid] > since:
+                changed.append(self._entries[ssid])
+
+        return dict(
+            since=since,
+            revision=self.revision,
+            added=added,
+            changed=changed,
+            removed=sorted(ssid for ssid, revision in self._removed.items() if revision > since)
+        )
+
+    def _prune_removed(self):
+        # Clients older than the forgotten removals have to fetch the whole table again
+        if len(self._removed) > self.keep_removed:
+            for ssid, revision in sorted(self._removed.items(), key=lambda item: item[1])[:-self.keep_removed]:
+                del self._removed[ssid]
+                self._oldest_delta = max(self._oldest_delta, revision)
+
+
+class SerializedPayload(object):
+    """
+    A response serialized to JSON, together with a gzip compressed copy
+    """
+
+    def __init__(self, data):
+        self.json = json.dumps(data, separators=(",", ":"))
+
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS) # gzip container
+        self.gzip = compressor.compress(self.json.encode("utf-8")) + compressor.flush()
+
+
+class NetworkState(object):
+    """
+    In-memory copy of the last known network status and access point table. The store is only valid as long as
+    something (the monitor) keeps it up to date, readers should refresh it first when it is not valid.
+
+    A state restored from a snapshot of an earlier run is stale until the next update, answers are marked with
+    stale and their age.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._status = None
+        self._valid = False
+        self._stale = False
+        self.access_points = AccessPointTable()
+        self.connections = None
+        self.updated = None
+        self.etag = None
+        self._payloads = {}
+
+    @property
+    def valid(self):
+        return self._valid
+
+    @property
+    def stale(self):
+        return self._stale
+
+    def get(self, since = None):
+        """
+        Returns a response with the status and either the full wifi list, or the wifi changes after revision since
+        """
+        with self._lock:
+            result = dict(status=self._status, revision=self.access_points.revision)
+
+            if self.access_points.can_delta(since):
+                result["wifisDelta"] = self.access_points.delta(since)
+            else:
+                result["wifis"] = self.access_points.list()
+
+            if self._stale:
+                result["stale"] = True
+                result["age"] = time.time() - self.updated
+
+            return result
+
+    def get_etag(self, since = None):
+        """
+        Returns the ETag of get(since). The full list and the delta after every revision are different answers
+        of the same state, so each gets its own tag.
+        """
+        with self._lock:
+            if self.etag is None:
+                return None
+
+            if self.access_points.can_delta(since):
+                return "{0}-{1}".format(self.etag, since)
+            return "{0}-full".format(self.etag)
+
+    def get_payload(self, since = None):
+        """
+        Returns get(since) as a SerializedPayload. The full list and the answer for clients that are up to date
+        are kept until the state changes, other deltas are serialized on every call.
+        """
+        with self._lock:
+            # The age of a stale state changes with every call
+            if self._stale:
+                return SerializedPayload(self.get(since))
+
+            if not self.access_points.can_delta(since):
+                key = "full"
+            elif since == self.access_points.revision:
+                key = "current"
+            else:
+                return SerializedPayload(self.get(since))
+
+            if key not in self._payloads:
+                self._payloads[key] = SerializedPayload(self.get(since))
+            return self._payloads[key]
+
+    def update(self, status, wifis):
+        """
+        Stores a new state. Returns a dict with the status and the wifi changes when they changed
+        """
+        with self._lock:
+            changes = {}
+            if status != self._status:
+                changes["status"] = status
+
+            changes.update(self._update_access_points(wifis))
+
+            # Clients that got the snapshot have to learn it is current now, even when nothing else changed
+            if self._stale:
+                changes["stale"] = False
+
+            self._status = status
+            self._valid = True
+            self._stale = False
+            self.updated = time.time()
+
+            if changes or self.etag is None:
+                self._changed()
+
+            return changes
+
+    def update_wifis(self, wifis):
+        """
+        Stores a new wifi list. Returns a dict with the wifi changes when they changed
+        """
+        with self._lock:
+            changes = self._update_access_points(wifis)
+
+            if changes:
+                self._changed()
+
+            return changes
+
+    def update_connections(self, connections):
+        with self._lock:
+            self.connections = connections
+
+    def snapshot(self):
+        """
+        Returns the state as a dict for write_snapshot, None when there is nothing known yet
+        """
+        with self._lock:
+            if self.updated is None:
+                return None
+
+            return dict(
+                time=self.updated,
+                status=self._status,
+                wifis=self.access_points.list(),
+                connections=self.connections
+            )
+
+    def restore(self, snapshot):
+        """
+        Restores a snapshot of an earlier run as a stale state, that is not valid until the next update
+        """
+        with self._lock:
+            self._status = snapshot.get("status")
+            self.access_points.update(snapshot.get("wifis") or [])
+            self.connections = snapshot.get("connections")
+            self.updated = snapshot["time"]
+            self._valid = False
+            self._stale = True
+            self._changed()
+
+    def invalidate(self):
+        with self._lock:
+            self._valid = False
+
+    def _changed(self):
+        self._payloads = {}
+
+        # The revision stands in for the wifi list, it changes whenever the list does
+        content = json.dumps(dict(status=self._status, revision=self.access_points.revision, stale=self._stale), sort_keys=True)
+        self.etag = hashlib.sha1(content.encode("utf-8")).hexdigest()
+
+    def _update_access_points(self, wifis):
+        since = self.access_points.revision
+
+        if self.access_points.update(wifis):
+            return dict(wifisDelta=self.access_points.delta(since))
+        return {}
+
+
+def write_snapshot(path, snapshot):
+    """
+    Writes a snapshot as gzip compressed JSON. The file is replaced at once, so a crash never leaves half of one.
+    """
+    data = json.dumps(dict(snapshot, version=SNAPSHOT_VERSION), separators=(",", ":"))
+
+    temp = path + ".tmp"
+    f = gzip.open(temp, "wb")
+    try:
+        f.write(data.encode("utf-8"))
+    finally:
+        f.close()
+
+    # rename doesn't replace files on Windows
+    if os.name == "nt" and os.path.exists(path):
+        os.remove(path)
+    os.rename(temp, path)
+
+
+def read_snapshot(path):
+    """
+    Returns the snapshot in path, or None when there is none or it has another layout
+    """
+    if not os.path.exists(path):
+        return None
+
+    f = gzip.open(path, "rb")
+    try:
+        snapshot = json.loads(f.read().decode("utf-8"))
+    finally:
+        f.close()
+
+    if snapshot.get("version") != SNAPSHOT_VERSION or "time" not in snapshot:
+        return None
+    return snapshot
@@ -16,6 +16,16 @@ $(function() {
 
         self.pollingEnabled = false;
         self.pollingTimeoutId = undefined;
+        // Status changes are pushed over the socket, polling is only a fallback
+        self.pollingInterval = 300000;
+
+        // Wifi list as of wifiRevision, the server sends the changes since that revision
+        self.wifis = [];
+        self.wifisBySsid = {};
+        self.wifiRevision = undefined;
+
+        // ETag of the last status response, the server answers 304 while nothing has changed
+        self.statusEtag = undefined;
 
         self.statusCurrentWifi = ko.observable();
         self.enableSignalSorting = ko.observable(false);
@@ -85,6 +95,15 @@ $(function() {
         self.working = ko.observable(false);
         self.statusUpdate = false;
         self.error = ko.observable(false);
+        self.stale = ko.observable(false);
+        self.staleAge = ko.observable();
+
+        self.staleText = ko.computed(function() {
+            var age = self.staleAge();
+            if (age === undefined)
+                return "";
+            return "Showing the network state of " + formatDuration(age) + " ago while NetworkManager starts.";
+        });
 
         self.ethernetConnectionText = ko.computed(function() {
             if(self.status.ethernet.connected()){
@@ -163,7 +182,7 @@ $(function() {
 
             data = ko.mapping.toJS(self.connectionDetails);
 
-            self._postCommand("connection_details/" + (self.connectionDetails.uuid() || self.connectionDetails.targetInterface()), { "details": data, "interface": self.connectionDetails.targetInterface() })
+            self._postOperation("connection_details/" + (self.connectionDetails.uuid() || self.connectionDetails.targetInterface()), { "details": data, "interface": self.connectionDetails.targetInterface() })
             .done(function () {
 
                 self.connectionDetailsEditorVisible(false);
@@ -242,7 +261,7 @@ $(function() {
             if (!self.loginState.isAdmin()) return; // Do something with error again?
 
             self.working(true);
-            return self._postCommand("wifi/configure", { ssid: ssid, psk: psk }, 15000)
+            return self._postOperation("wifi/configure", { ssid: ssid, psk: psk })
                 .done(function () { self.requestData(true); }) // Will hide the loading icon
                 .fail(function () { self.working(false); });
         };
@@ -251,7 +270,7 @@ $(function() {
             if (!self.loginState.isAdmin()) return;
 
             self.working(true);
-            self._postCommand("wifi/disconnect").done(function () {
+            self._postOperation("wifi/disconnect").done(function () {
                 $.notify({
                     title: "Disconnected success",
                     text: "You have successfully disconnected the wifi connection"
@@ -286,7 +305,33 @@ $(function() {
             }
 
             var url = OctoPrint.getBlueprintUrl("networkmanager");
-            OctoPrint.get(url).done(self.fromResponse).always(function()
+            if (self.wifiRevision !== undefined)
+                url += "?since=" + self.wifiRevision;
+
+            var headers = {};
+            if (self.statusEtag !== undefined)
+                headers["If-None-Match"] = self.statusEtag;
+
+            OctoPrint.get(url, { headers: headers }).done(function (response, textStatus, xhr) {
+                if (xhr.status == 304) {
+                    self.schedulePolling();
+                    return;
+                }
+
+                self.statusEtag = xhr.getResponseHeader("ETag") || undefined;
+                self.fromResponse(response);
+            }).fail(function (xhr) {
+                if (xhr.status != 503)
+                    return;
+
+                // The backend is still starting on the server, ask again shortly
+                var response = xhr.responseJSON || {};
+                if (response.status == "initializing") {
+                    self.pollingTimeoutId = setTimeout(function () { self.requestData(showWorker); }, 1000);
+                } else {
+                    self.error(true);
+                }
+            }).always(function()
             {
                 if (showWorker)
                     self.working(false);
@@ -296,9 +341,13 @@ $(function() {
         self.sendWifiRefresh = function() {
             self.working(true);
 
+            // The rescan runs as a job that refreshes of other clients join
             return self._postCommand("wifi/scan")
-                .done(function (response) {
-                    self.fromResponse(response);
+                .then(function (job) {
+                    return self._waitForJob("wifi/scan/" + job.id, job);
+                })
+                .done(function () {
+                    self.requestData();
                 })
                 .fail(function () {
                     $.notify({
@@ -313,6 +362,27 @@ $(function() {
                 });
         };
 
+        self._waitForJob = function (endpoint, job) {
+            // Scans and changes run in the background, poll the job until it has finished
+            var deferred = $.Deferred();
+            var url = OctoPrint.getBlueprintUrl("networkmanager") + endpoint;
+
+            var check = function (job) {
+                if (job.state == "done" || job.state == "succeeded") {
+                    deferred.resolve(job);
+                } else if (job.state == "failed") {
+                    deferred.reject(job);
+                } else {
+                    window.setTimeout(function () {
+                        OctoPrint.get(url).done(check).fail(deferred.reject);
+                    }, 1000);
+                }
+            };
+            check(job);
+
+            return deferred.promise();
+        };
+
         self.setDefaultConnectionDetails = function()
         {
             self.connectionDetails.ipv4.method("auto");
@@ -340,7 +410,7 @@ $(function() {
                 // If this isn't an automated status update, but a user's action: notify the back-end
                 if (wifiEnabled) {
                     self.working(true);
-                    self._postCommand('wifi/enable').done(function () {
+                    self._postOperation('wifi/enable').done(function () {
                         // Wait with the refresh
                         window.setTimeout(function () { 
                             self.sendWifiRefresh().done(function () {
@@ -360,7 +430,7 @@ $(function() {
                 }
                 else {
                     self.working(true);
-                    self._postCommand('wifi/disable').done(function() { self.requestData(true); }) // Reset the ip address etc
+                    self._postOperation('wifi/disable').done(function() { self.requestData(true); }) // Reset the ip address etc
                 }
             }
         }
@@ -410,6 +480,13 @@ $(function() {
             return OctoPrint.postJson(url, data, params);
         };
 
+        self._postOperation = function (endpoint, data) {
+            // Changes are queued on the server, resolve once the operation has run
+            return self._postCommand(endpoint, data).then(function (operation) {
+                return self._waitForJob("operations/" + operation.id, operation);
+            });
+        };
+
         self.fromResponse = function (response) {
             if (response.error !== undefined) {
                 self.error(true);
@@ -418,39 +495,117 @@ $(function() {
                 self.error(false);
             }
 
+            // Answered from the state of the last run while the server refreshes it
+            self.stale(response.stale === true);
+            self.staleAge(response.stale === true ? response.age : undefined);
+
+            self.fromData(response);
+            self.schedulePolling();
+        };
+
+        self.onDataUpdaterPluginMessage = function (plugin, data) {
+            if (plugin != "networkmanager") return;
+
+            self.fromData(data);
+
+            // The radio is back after a reset, fetch the new status
+            if (data.reset && data.reset.state == "done" && self.pollingEnabled)
+                self.requestData();
+
+            // Postpone the fallback poll, we have just been brought up to date
+            if (self.pollingTimeoutId !== undefined)
+                self.schedulePolling();
+        };
+
+        self.schedulePolling = function () {
+            if (self.pollingTimeoutId !== undefined) {
+                clearTimeout(self.pollingTimeoutId);
+                self.pollingTimeoutId = undefined;
+            }
+
+            if (self.pollingEnabled) {
+                self.pollingTimeoutId = setTimeout(function () {
+                    if(!self.working())
+                        self.requestData();
+                }, self.pollingInterval);
+            }
+        };
+
+        self.applyWifis = function (data) {
+            if (data.wifis) {
+                self.wifisBySsid = {};
+                _.each(data.wifis, function (wifi) {
+                    self.wifisBySsid[wifi.ssid] = wifi;
+                });
+                self.wifiRevision = data.revision;
+            } else if (data.wifisDelta) {
+                var delta = data.wifisDelta;
+
+                // Tabs that never loaded the list, or don't show it, have nothing to apply the delta to
+                if (self.wifiRevision === undefined || !self.pollingEnabled)
+                    return false;
+
+                if (delta.since !== self.wifiRevision) {
+                    // We have missed a change, fetch everything since our revision
+                    self.requestData();
+                    return false;
+                }
 
-            if (response.status) {
+                _.each(delta.added.concat(delta.changed), function (wifi) {
+                    self.wifisBySsid[wifi.ssid] = wifi;
+                });
+                _.each(delta.removed, function (ssid) {
+                    delete self.wifisBySsid[ssid];
+                });
+                self.wifiRevision = delta.revision;
+            } else {
+                return false;
+            }
+
+            self.wifis = _.values(self.wifisBySsid);
+            return true;
+        };
+
+        self.fromData = function (data) {
+            var wifisChanged = self.applyWifis(data);
+
+            if (data.stale !== undefined)
+                self.stale(data.stale);
+
+            if (data.status) {
 
                 self.statusUpdate = true;
 
-                self.status.ethernet.connected(response.status.ethernet.connected);
-                self.status.ethernet.ip(response.status.ethernet.ip);
-                self.status.ethernet.uuid(response.status.ethernet.connection_uuid);
-                self.status.ethernet.enabled(response.status.ethernet.enabled);
-                self.status.ethernet.macAddress(response.status.ethernet.mac_address);
+                self.status.ethernet.connected(data.status.ethernet.connected);
+                self.status.ethernet.ip(data.status.ethernet.ip);
+                self.status.ethernet.uuid(data.status.ethernet.connection_uuid);
+                self.status.ethernet.enabled(data.status.ethernet.enabled);
+                self.status.ethernet.macAddress(data.status.ethernet.mac_address);
 
-                self.status.wifi.connected(response.status.wifi.connected);
-                self.status.wifi.ip(response.status.wifi.ip);
-                self.status.wifi.ssid(response.status.wifi.ssid);
-                self.status.wifi.uuid(response.status.wifi.connection_uuid);
-                self.status.wifi.enabled(response.status.wifi.enabled);
-                self.status.wifi.macAddress(response.status.wifi.mac_address);
+                self.status.wifi.connected(data.status.wifi.connected);
+                self.status.wifi.ip(data.status.wifi.ip);
+                self.status.wifi.ssid(data.status.wifi.ssid);
+                self.status.wifi.uuid(data.status.wifi.connection_uuid);
+                self.status.wifi.enabled(data.status.wifi.enabled);
+                self.status.wifi.macAddress(data.status.wifi.mac_address);
 
+                self.statusUpdate = false;
+            }
+
+            if (data.status || wifisChanged) {
                 self.statusCurrentWifi(undefined);
-                if (response.status.wifi.ssid) {
-                    _.each(response.wifis, function(wifi) {
-                        if (wifi.ssid === response.status.wifi.ssid) {
+                if (self.status.wifi.ssid()) {
+                    _.each(self.wifis, function(wifi) {
+                        if (wifi.ssid === self.status.wifi.ssid()) {
                             self.statusCurrentWifi(self.getEntryId(wifi));
                         }
                     });
                 }
-
-                self.statusUpdate = false;
             }
 
-            if (response.wifis) {
+            if (wifisChanged) {
                 var enableSignalSorting = false;
-                _.each(response.wifis, function(wifi) {
+                _.each(self.wifis, function(wifi) {
                     if (wifi.signal !== undefined) {
                         enableSignalSorting = true;
                     }
@@ -458,7 +613,7 @@ $(function() {
                 self.enableSignalSorting(enableSignalSorting);
 
                 var wifis = [];
-                _.each(response.wifis, function(wifi) {
+                _.each(self.wifis, function(wifi) {
                     wifis.push({
                         ssid: wifi.ssid,
                         signal: wifi.signal,
@@ -472,13 +627,6 @@ $(function() {
                     self.listHelper.changeSorting("ssid");
                 }
             }
-
-            if (self.pollingEnabled) {
-                self.pollingTimeoutId = setTimeout(function () {
-                    if(!self.working())
-                        self.requestData();
-                }, 30000);
-            }
         };
 
     }
@@ -0,0 +1,155 @@
+# coding=utf-8
+import collections
+import functools
+import json
+import logging
+import logging.handlers
+import threading
+import time
+import uuid
+
+from capture import redact_command
+
+
+class Trace(object):
+    def __init__(self, route, method):
+        self.id = uuid.uuid4().hex[:16]
+        self.route = route
+        self.method = method
+        self.status = None
+        self.start = time.time()
+        self.duration = None
+        self.spans = []
+        self.stack = []
+
+    def as_dict(self):
+        return dict(
+            id=self.id,
+            route=self.route,
+            method=self.method,
+            status=self.status,
+            start=self.start,
+            duration=self.duration,
+            spans=self.spans
+        )
+
+
+class Tracer(object):
+    """
+    Records what happens while a blueprint request is answered. Every request gets a correlation id and a tree of
+    spans: the instrumented methods it called and the commands they ran, with the command line (secrets redacted),
+    start, duration and the bytes of output. Finished traces are written as JSON lines to a rotating file,
+    the last keep of them are kept in memory for slowest().
+
+    Spans are only recorded on the thread that answers the request, work that is handed to the background
+    (queued operations, scans) is not part of the trace.
+    """
+
+    def __init__(self, path, max_bytes = 1024 * 1024, backup_count = 3, keep = 100):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._recent = collections.deque(maxlen=keep)
+
+        self._handler = logging.handlers.RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backup_count)
+        self._handler.setFormatter(logging.Formatter("%(message)s"))
+
+        self._logger = logging.getLogger("octoprint.plugins.networkmanager.traces")
+        self._logger.setLevel(logging.INFO)
+        self._logger.propagate = False
+        self._logger.addHandler(self._handler)
+
+    @property
+    def current(self):
+        return getattr(self._local, "trace", None)
+
+    def start_request(self, route, method):
+        trace = Trace(route, method)
+        self._local.trace = trace
+        return trace
+
+    def finish_request(self, status):
+        trace = self.current
+        if trace is None:
+            return None
+
+        self._local.trace = None
+        trace.status = status
+        trace.duration = time.time() - trace.start
+
+        with self._lock:
+            self._recent.append(trace)
+
+        self._logger.info(json.dumps(trace.as_dict()))
+        return trace
+
+    def span(self, name, function, *args, **kwargs):
+        """
+        Calls function as a span of the current trace, or just calls it when there is none
+        """
+        trace = self.current
+        if trace is None:
+            return function(*args, **kwargs)
+
+        span = dict(id=len(trace.spans) + 1, parent=trace.stack[-1]["id"] if trace.stack else None,
+                    name=name, start=time.time(), duration=None)
+        trace.spans.append(span)
+        trace.stack.append(span)
+
+        try:
+            return function(*args, **kwargs)
+        except Exception as e:
+            span["error"] = str(e)
+            raise
+        finally:
+            span["duration"] = time.time() - span["start"]
+            trace.stack.pop()
+
+    def traced(self, name):
+        """
+        Decorator that records every call as a span named name
+        """
+        def decorator(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                return self.span(name, function, *args, **kwargs)
+            return wrapper
+        return decorator
+
+    def instrument(self, instance, names):
+        """
+        Replaces the methods of instance called names by traced ones, named after their class and method
+        """
+        for name in names:
+            method = getattr(instance, name, None)
+            if method is not None:
+                setattr(instance, name, self.traced("{0}.{1}".format(type(instance).__name__, name))(method))
+
+    def observe_command(self, target, command, returncode, output, latency):
+        """
+        Command observer that adds the command as a span of the method that ran it
+        """
+        trace = self.current
+        if trace is None:
+            return
+
+        now = time.time()
+        trace.spans.append(dict(
+            id=len(trace.spans) + 1,
+            parent=trace.stack[-1]["id"] if trace.stack else None,
+            name="command",
+            start=now - latency,
+            duration=latency,
+            argv=[target] + redact_command(command),
+            returncode=returncode,
+            output_bytes=len(output or "")
+        ))
+
+    def slowest(self, limit = 10):
+        with self._lock:
+            traces = list(self._recent)
+
+        return [trace.as_dict() for trace in sorted(traces, key=lambda trace: trace.duration, reverse=True)[:limit]]
+
+    def close(self):
+        self._logger.removeHandler(self._handler)
+        self._handler.close()